@@ -0,0 +1,321 @@
+import asyncio
+import time
+import socket	#Library for sockets
+import struct	#Performs conversions between Python values and bytes objects
+import YeeMetrics
+from YeeBulb import YeeBulb
+from YeeMusic import YeeMusicChannel
+from YeeRegistry import BulbRegistry
+from YeeProtocol import FRAME_END, parse_frame, encode_request
+from YeeDiscovery import MCAST_GRP, MCAST_PORT, ResponseCache, SearchSchedule, search_message
+
+#Async bulb class
+class AsyncYeeBulb(YeeBulb):
+	"""
+	asyncio version of YeeBulb with the same methods, each one a coroutine:
+		result = await bulb.set_rgb(255)
+	Every bulb keeps one asyncio stream open. Replies are matched to requests by "id",
+	so any number of commands to the bulb can be awaited concurrently.
+	"""
+	__slots__ = ("reader", "writer", "pending", "read_task", "connect_lock")
+	def __init__(self, bulb_id, bulb_ip, bulb_port, model, name, methods):
+		super().__init__(bulb_id, bulb_ip, bulb_port, model, name, methods)
+		self.reader = None
+		self.writer = None
+		self.pending = {} #{request_id: future}
+		self.read_task = None
+		self.connect_lock = None #Created on first use, inside the running loop
+
+	async def done(self, result):
+		return result
+
+	async def connect(self):
+		"""Opens the stream if it is not open yet"""
+		if self.connect_lock is None:
+			self.connect_lock = asyncio.Lock()
+		async with self.connect_lock:
+			if self.writer is not None and not self.writer.is_closing():
+				return
+			YeeBulb.display("connecting " + self.ip +" "+ self.port +"...")
+			self.reader, self.writer = await asyncio.open_connection(self.ip, int(self.port))
+			self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self.read_task = asyncio.ensure_future(self.read_loop(self.reader, self.writer))
+
+	async def operate(self, method, params):
+		"""Coroutine version of YeeBulb.operate(), with the same timeouts, retries and circuit breaker"""
+		YeeBulb.display("\nOperating")
+		if not self.supports_method(method):
+			YeeBulb.display("ERROR\nMethod is not supported.")
+			return (False, "Method is not supported")
+		trace = None
+		metrics = YeeMetrics.collector
+		if metrics is not None:
+			trace = metrics.trace(self, method)
+		if self.music is not None and method not in YeeBulb.MUSIC_BYPASS:
+			result = self.music_request(method, params, trace)
+			if result is not None:
+				return result if trace is None else trace.finish(result)
+		if not self.breaker.allow():
+			result = (False, "Bulb is not responding (circuit open)")
+			return result if trace is None else trace.finish(result)
+		deadline = None
+		attempt = 0
+		while True:
+			wait = 0
+			if method in YeeBulb.QUOTA_BYPASS:
+				self.limiter.force()
+			elif deadline is None:
+				wait = self.limiter.reserve() #Wait for a slot within the bulb's quota
+			else:
+				wait = self.limiter.reserve(deadline - time.monotonic())
+				if wait is None:
+					self.breaker.failure() #No slot for the retry before the deadline, keep the last error
+					break
+			if wait:
+				try:
+					await asyncio.sleep(wait)
+				finally:
+					self.limiter.finish(wait)
+			if deadline is None:
+				deadline = time.monotonic() + YeeBulb.CALL_TIMEOUT #The quota wait is not part of the call's time limit
+			if trace is not None:
+				trace.mark("quota")
+			if self.music is not None and method not in YeeBulb.MUSIC_BYPASS:
+				#Music mode came on while waiting, e.g. handle_burst()
+				result = self.music_request(method, params, trace)
+				if result is not None:
+					break
+			try:
+				result = await self.attempt(method, params, trace, deadline)
+				self.breaker.success()
+				break
+			except (OSError, asyncio.TimeoutError) as e: #Timeouts and connection errors
+				YeeBulb.display("Unexpected error:" + str(e))
+				result = (False, e)
+				delay = self.retry_delay(method, attempt, deadline)
+				if delay is None:
+					self.breaker.failure()
+					break
+				attempt += 1
+				if trace is not None:
+					trace.retries += 1
+				await asyncio.sleep(delay)
+			except Exception as e:
+				YeeBulb.display("Unexpected error:" + str(e))
+				result = (False, e)
+				self.breaker.failure() #Also ends a half open trial
+				break
+		if trace is not None:
+			trace.finish(result)
+		return result
+
+	async def attempt(self, method, params, trace, deadline):
+		"""One attempt of operate(): connect if needed, send and wait for the reply within the time limits"""
+		msg_id = self.next_id()
+		data = encode_request(msg_id, method, params)
+		await asyncio.wait_for(self.connect(), self.budget(YeeBulb.CONNECT_TIMEOUT, deadline))
+		if trace is not None:
+			trace.mark("connect")
+			trace.bytes_sent = len(data)
+		if not YeeBulb.HANDLE_RESPONSE:
+			self.writer.write(data)
+			await self.writer.drain()
+			return (True, "")
+		future = asyncio.get_running_loop().create_future()
+		self.pending[msg_id] = future
+		try:
+			self.writer.write(data)
+			await self.writer.drain()
+			if trace is not None:
+				trace.mark("send")
+			reply = await asyncio.wait_for(future, self.budget(YeeBulb.REPLY_TIMEOUT, deadline))
+		finally:
+			self.pending.pop(msg_id, None)
+		if trace is not None:
+			trace.mark("wait")
+		result = self.handle_reply(method, reply)
+		if trace is not None:
+			trace.mark("parse")
+		return result
+
+	def handle_burst(self):
+		if YeeBulb.AUTO_MUSIC:
+			asyncio.ensure_future(self.set_music(1))
+
+	async def set_music(self, action, host = None, port = 0):
+		"""Coroutine version of YeeBulb.set_music(), waits for the bulb's connection without blocking the loop"""
+		if int(action) != 1:
+			self.stop_music()
+			return (True, "ok")
+		if self.music is not None:
+			return (True, "ok")
+		channel = YeeMusicChannel(self.ip, host, port)
+		try:
+			host, port = channel.listen()
+			channel.server.setblocking(False)
+			result = await self.operate("set_music", "1,\"" + str(host) + "\"," + str(port))
+			if result[0]:
+				loop = asyncio.get_running_loop()
+				sock, _ = await asyncio.wait_for(loop.sock_accept(channel.server), channel.timeout)
+				channel.server.close()
+				channel.server = None
+				channel.attach(sock)
+				self.music = channel
+				return result
+			channel.close()
+			return result
+		except Exception as e:
+			channel.close()
+			YeeBulb.display("Music mode failed:" + str(e))
+			return (False, e)
+
+	def submit(self, method, params):
+		"""Schedules a command and returns the asyncio.Task, the coroutine counterpart of YeeBulb.submit()"""
+		return asyncio.ensure_future(self.operate(method, params))
+
+	async def read_loop(self, reader, writer):
+		"""Reads reply lines and resolves the future waiting for each "id" """
+		error = ConnectionError("Connection closed by bulb")
+		try:
+			while True:
+				frame = parse_frame(await reader.readuntil(FRAME_END))
+				if frame is not None:
+					self.dispatch(frame)
+		except asyncio.IncompleteReadError:
+			pass
+		except (OSError, asyncio.LimitOverrunError) as e:
+			error = ConnectionError(str(e))
+		finally:
+			writer.close()
+			if self.writer is writer:
+				self.reader = None
+				self.writer = None
+			pending = self.pending
+			self.pending = {}
+			for future in pending.values():
+				if not future.done():
+					future.set_exception(error)
+
+	def dispatch(self, frame):
+		future = self.pending.pop(frame.get("id"), None)
+		if future is None:
+			self.handle_message(frame)
+		elif not future.done():
+			future.set_result(frame)
+
+	async def get_state(self, req_params, max_age = None, refresh = False):
+		"""Coroutine version of YeeBulb.get_state()"""
+		if not refresh:
+			cached = self.cached_state(req_params, max_age)
+			if cached is not None:
+				return (True, cached)
+		return self.store_state(req_params, await self.operate("get_prop", YeeBulb.prop_params(req_params)))
+
+	def update_info(self, response):
+		if response["ip"] != self.ip or response["port"] != self.port:
+			asyncio.ensure_future(self.close()) #Drop the stream to the old address
+		super().update_info(response)
+
+	async def info(self):
+		"""Returns bulb information"""
+		return self.format_info(await self.get_state(YeeBulb.supported_properties))
+
+	async def close(self):
+		"""Closes the stream and the music channel"""
+		self.stop_music()
+		writer = self.writer
+		if writer is not None:
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except OSError:
+				pass
+		if self.read_task is not None:
+			await asyncio.gather(self.read_task, return_exceptions = True)
+			self.read_task = None
+
+#Discovery protocol class
+class YeeDiscoveryProtocol(asyncio.DatagramProtocol):
+	"""Datagram protocol handing every received search response to a callback"""
+	def __init__(self, on_response):
+		self.on_response = on_response
+
+	def datagram_received(self, data, addr):
+		self.on_response(data.decode(errors = "replace"), addr)
+
+#Async discovery class
+class AsyncBulbDiscovery:
+	"""
+	Event-driven bulb discovery for one event loop.
+	Replies to our search requests and bulb advertisements are delivered by the loop as they
+	arrive, no polling. Found bulbs are AsyncYeeBulb objects in 'registry' (BulbRegistry).
+	Args:
+		schedule: SearchSchedule timing the search broadcasts (backoff and jitter)
+		listen: also listen for advertisements on MCAST_PORT (needs the port to be free)
+		on_bulb: optional callback(bulb) for every newly found bulb
+	"""
+	def __init__(self, schedule = None, listen = True, on_bulb = None):
+		self.schedule = schedule if schedule is not None else SearchSchedule()
+		self.found_new = False
+		self.responses = ResponseCache()
+		self.listen = listen
+		self.on_bulb = on_bulb
+		self.registry = BulbRegistry()
+		self.scan_transport = None
+		self.listen_transport = None
+		self.search_task = None
+
+	async def start(self):
+		"""Opens the sockets and starts broadcasting search requests"""
+		loop = asyncio.get_running_loop()
+		self.scan_transport, _ = await loop.create_datagram_endpoint(
+			lambda: YeeDiscoveryProtocol(self.handle_response),
+			local_addr = ("0.0.0.0", 0), family = socket.AF_INET)
+		if self.listen:
+			listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			listen_socket.bind(("", MCAST_PORT))
+			mreq = struct.pack("=4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
+			listen_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+			listen_socket.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_LOOP, 0)
+			listen_socket.setblocking(False)
+			self.listen_transport, _ = await loop.create_datagram_endpoint(
+				lambda: YeeDiscoveryProtocol(self.handle_response), sock = listen_socket)
+		self.search_task = asyncio.ensure_future(self.search_loop())
+
+	async def search_loop(self):
+		while True:
+			self.registry.expire()
+			self.search()
+			found_new = self.found_new
+			self.found_new = False
+			await asyncio.sleep(self.schedule.next_delay(found_new))
+
+	def search(self):
+		"""Multicasts one search request, replies arrive through handle_response()"""
+		self.scan_transport.sendto(search_message().encode(), (MCAST_GRP, MCAST_PORT))
+
+	def handle_response(self, data, addr):
+		"""Adds a newly found bulb or updates a known one in place"""
+		response, changed = self.responses.parse(data, time.monotonic())
+		if response == None:
+			return
+		if not changed and self.registry.touch(response["id"]):
+			return #Same advertisement as before
+		bulb, added = self.registry.update(response, AsyncYeeBulb)
+		if added:
+			self.found_new = True
+			if self.on_bulb is not None:
+				self.on_bulb(bulb)
+
+	async def close(self):
+		"""Stops searching and closes the sockets and all bulb streams"""
+		if self.search_task is not None:
+			self.search_task.cancel()
+			await asyncio.gather(self.search_task, return_exceptions = True)
+			self.search_task = None
+		for transport in (self.scan_transport, self.listen_transport):
+			if transport is not None:
+				transport.close()
+		self.scan_transport = None
+		self.listen_transport = None
+		await asyncio.gather(*(bulb.close() for bulb in self.registry.values()))
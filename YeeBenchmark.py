@@ -0,0 +1,266 @@
+import sys	#For sys.exit()
+import json
+import time
+import platform
+import argparse
+import threading
+import tracemalloc
+from YeeBulb import YeeBulb
+from YeeGroup import BulbGroup
+from YeeRateLimiter import YeeRateLimiter
+from YeeSimulator import Simulator, SUPPORTED_METHODS
+from YeeLightController import YeeLightController
+from YeeProtocol import encode_request, quoted
+
+#----------Variables----------
+#Commands timed by bench_latency {name: (YeeBulb method, args)}
+LATENCY_COMMANDS = {
+	"get_prop": ("get_state", (["power", "bright", "rgb"], None, True)),
+	"set_power": ("turn_on", ()),
+	"set_bright": ("set_bright", (50,)),
+	"set_rgb": ("set_rgb", (255,)),
+	"set_ct_abx": ("set_ct", (4000,)),
+	"toggle": ("toggle", ()),
+}
+NO_QUOTA = 10 ** 9 #Quota for simulator and limiter, the benchmarks measure the library, not the firmware limit
+
+#----------Functions----------
+def percentile(values, p):
+	"""p-th percentile (0-100) of 'values', nearest rank"""
+	if not values:
+		return None
+	ordered = sorted(values)
+	rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+	return ordered[rank]
+
+def summary(samples):
+	"""Latency statistics in milliseconds"""
+	return {
+		"samples": len(samples),
+		"p50_ms": percentile(samples, 50) * 1000,
+		"p99_ms": percentile(samples, 99) * 1000,
+		"max_ms": max(samples) * 1000,
+	}
+
+def make_bulbs(sim):
+	"""YeeBulb instances for the simulated bulbs, with the quota limiter out of the way"""
+	bulbs = []
+	for sim_bulb in sim.bulbs:
+		bulb = YeeBulb(sim_bulb.index, sim.host, str(sim_bulb.port), sim_bulb.model, "", SUPPORTED_METHODS)
+		bulb.limiter = YeeRateLimiter(rate = NO_QUOTA, burst = NO_QUOTA // 2)
+		bulbs.append(bulb)
+	return bulbs
+
+def bench_latency(samples = 200, **options):
+	"""p50/p99 latency of operate() per method against one simulated bulb"""
+	sim = Simulator(1, quota = NO_QUOTA, **options)
+	sim.start()
+	bulb = make_bulbs(sim)[0]
+	results = {}
+	try:
+		for name, (method, args) in LATENCY_COMMANDS.items():
+			call = getattr(bulb, method)
+			call(*args) #Warm up, the first call opens the connection
+			times = []
+			for _ in range(samples):
+				start = time.perf_counter()
+				call(*args)
+				times.append(time.perf_counter() - start)
+			results[name] = summary(times)
+	finally:
+		bulb.close()
+		sim.stop()
+	return results
+
+def bench_throughput(commands = 1000, bulbs = 10, **options):
+	"""Commands per second for one bulb (sequential) and for N bulbs (BulbGroup fan-out)"""
+	sim = Simulator(bulbs, quota = NO_QUOTA, **options)
+	sim.start()
+	members = make_bulbs(sim)
+	try:
+		single = members[0]
+		single.set_bright(1)
+		start = time.perf_counter()
+		for i in range(commands):
+			single.set_bright(i % 100 + 1)
+		one = commands / (time.perf_counter() - start)
+
+		group = BulbGroup("benchmark", members)
+		group.call("set_bright", 1)
+		rounds = max(1, commands // len(members))
+		start = time.perf_counter()
+		for i in range(rounds):
+			group.call("set_bright", i % 100 + 1)
+		many = rounds * len(members) / (time.perf_counter() - start)
+	finally:
+		for bulb in members:
+			bulb.close()
+		sim.stop()
+	return {"one_bulb_cmd_per_s": one, "bulbs": len(members), "n_bulbs_cmd_per_s": many}
+
+def bench_discovery(bulbs = 50, timeout = 10.0, **options):
+	"""Time from start() until bulbs_detection_loop has registered all N simulated bulbs"""
+	sim = Simulator(bulbs, **options)
+	sim.start()
+	controller = YeeLightController(search_address = sim.search_address, listen_port = 0)
+	found = threading.Event()
+	controller.registry.add_listener(lambda event, bulb: len(controller.registry) >= bulbs and found.set())
+	start = time.perf_counter()
+	controller.start()
+	complete = found.wait(timeout)
+	elapsed = time.perf_counter() - start
+	controller.stop()
+	sim.stop()
+	return {"bulbs": bulbs, "found": complete, "time_to_discover_s": elapsed if complete else None}
+
+def bench_idle_cpu(seconds = 5.0, bulbs = 10, **options):
+	"""
+	CPU time used while discovery sits idle after finding the bulbs, as a fraction of one core.
+	The simulator runs in the same process, so this is an upper bound for the controller.
+	"""
+	sim = Simulator(bulbs, **options)
+	sim.start()
+	controller = YeeLightController(search_address = sim.search_address, listen_port = 0)
+	controller.start()
+	deadline = time.monotonic() + 5
+	while len(controller.registry) < bulbs and time.monotonic() < deadline:
+		time.sleep(0.05)
+	cpu = time.process_time()
+	wall = time.perf_counter()
+	time.sleep(seconds)
+	cpu = time.process_time() - cpu
+	wall = time.perf_counter() - wall
+	controller.stop()
+	sim.stop()
+	return {"seconds": wall, "cpu_s": cpu, "cpu_fraction": cpu / wall}
+
+def failed_checks(results):
+	"""Names of the benchmarks in run() 'results' that report a limit as exceeded ("within_limit": false)"""
+	return [name for name, result in results["results"].items() if isinstance(result, dict) and result.get("within_limit") is False]
+
+def legacy_request(msg_id, bright, effect, duration):
+	"""set_bright request built the way setters and operate() did before the templates: string concatenation"""
+	params = str(bright) + ",\"" + str(effect) + "\"," + str(duration)
+	msg = "{\"id\":" + str(msg_id) + ",\"method\":\""
+	msg += "set_bright" + "\",\"params\":[" + params + "]}\r\n"
+	return msg.encode()
+
+def bench_encoding(commands = 100000, **options):
+	"""
+	Cost of encoding one set_bright request, string concatenation against encode_request() templates.
+	Allocated bytes are the peak memory one command takes above the baseline (tracemalloc),
+	i.e. its throwaway strings and the request bytes.
+	No bulbs are involved, simulator options are ignored.
+	"""
+	smooth = quoted("smooth")
+	paths = {
+		"concat": lambda i: legacy_request(i, i % 100 + 1, "smooth", 500),
+		"template": lambda i: encode_request(i, "set_bright", (i % 100 + 1, smooth, 500)),
+	}
+	for i in range(1, 101):
+		if paths["template"](i) != paths["concat"](i):
+			raise AssertionError("encode_request output differs from the concatenated request")
+	results = {}
+	for name, encode in paths.items():
+		start = time.perf_counter()
+		for i in range(commands):
+			encode(i)
+		elapsed = time.perf_counter() - start
+		results[name] = {"us_per_cmd": elapsed / commands * 1e6, "allocated_bytes_per_cmd": allocated_bytes(encode)}
+	return results
+
+def allocated_bytes(call, samples = 1000):
+	"""Largest peak memory (bytes) call(i) allocated above what was in use before it"""
+	peak = 0
+	tracemalloc.start()
+	try:
+		for i in range(samples):
+			tracemalloc.reset_peak()
+			before = tracemalloc.get_traced_memory()[0]
+			call(i)
+			peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+	finally:
+		tracemalloc.stop()
+	return peak
+
+def bench_memory(bulbs = 1000, **options):
+	"""
+	Memory per idle bulb (tracemalloc): N YeeBulbs with a full state cache and no open connection,
+	checked against YeeBulb.MEMORY_LIMIT. main() exits with status 1 when the limit is exceeded.
+	No simulator is involved, its options are ignored.
+	"""
+	ips = ["10.0.%d.%d" % (i // 250, i % 250 + 1) for i in range(bulbs)] #Allocated before tracing starts
+	props = {prop: "1" for prop in YeeBulb.supported_properties}
+	props["name"] = "bulb"
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		members = [YeeBulb(i + 1, ips[i], "55443", "color", "", SUPPORTED_METHODS) for i in range(bulbs)]
+		for bulb in members:
+			bulb.update_state(props)
+		per_bulb = (tracemalloc.get_traced_memory()[0] - before) / bulbs
+	finally:
+		tracemalloc.stop()
+	return {
+		"bulbs": bulbs,
+		"bytes_per_bulb": per_bulb,
+		"limit": YeeBulb.MEMORY_LIMIT,
+		"within_limit": per_bulb <= YeeBulb.MEMORY_LIMIT,
+		"shared_method_sets": len(set(id(bulb.method_set) for bulb in members)),
+	}
+
+#Benchmarks run by default {name: function}
+BENCHMARKS = {
+	"latency": bench_latency,
+	"throughput": bench_throughput,
+	"discovery": bench_discovery,
+	"idle_cpu": bench_idle_cpu,
+	"encoding": bench_encoding,
+	"memory": bench_memory,
+}
+
+def run(names = None, **options):
+	"""Runs the named benchmarks (all by default), returns the JSON-serialisable results"""
+	YeeBulb.DISPLAY_MSG = False
+	results = {
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"options": options,
+		"results": {},
+	}
+	for name in names or BENCHMARKS:
+		results["results"][name] = BENCHMARKS[name](**options)
+	return results
+
+#----------Main----------
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = "Benchmarks against simulated bulbs, prints or writes JSON results")
+	parser.add_argument("names", nargs = "*", help = "benchmarks to run: " + ", ".join(BENCHMARKS) + " (default: all)")
+	parser.add_argument("-o", "--output", help = "write the results to this file")
+	parser.add_argument("--latency", type = float, default = 0.0, help = "simulated reply latency (s)")
+	parser.add_argument("--loss", type = float, default = 0.0, help = "simulated packet loss (0-1)")
+	args = parser.parse_args(argv)
+	for name in args.names:
+		if name not in BENCHMARKS:
+			parser.error("unknown benchmark " + name)
+	options = {}
+	if args.latency:
+		options["latency"] = args.latency
+	if args.loss:
+		options["loss"] = args.loss
+	results = run(args.names, **options)
+	text = json.dumps(results, indent = 2)
+	if args.output:
+		with open(args.output, "w") as output:
+			output.write(text + "\n")
+	else:
+		print(text)
+	failed = failed_checks(results)
+	if failed:
+		sys.stderr.write("Limit exceeded: " + ", ".join(failed) + "\n")
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
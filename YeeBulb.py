@@ -1,5 +1,29 @@
-import socket
-import re
+import threading
+import time
+import random
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from YeeConnection import YeeConnectionPool
+from YeeRateLimiter import YeeRateLimiter
+from YeeMusic import YeeMusicChannel
+from YeeQueue import YeeCommandQueue, COALESCE_KEYS
+from YeeCircuitBreaker import YeeCircuitBreaker
+from YeeFlow import ACTION_RECOVER, ACTION_STAY, ACTION_OFF, check_step, flow_params
+from YeeScene import scenes, scene_params
+import YeeMetrics
+from YeeState import YeeState, NEVER
+from YeeProtocol import result_from_frame, convert_prop, convert_props, is_notification, encode_request, quoted
+
+#----------Variables----------
+_method_sets = {} #{methods tuple: (methods tuple, frozenset)}, one entry per distinct "support" line
+
+#----------Functions----------
+def intern_methods(methods):
+	"""Returns the shared (ordered tuple, frozenset) for a bulb's supported methods"""
+	methods = tuple(methods)
+	entry = _method_sets.get(methods)
+	if entry is None:
+		entry = _method_sets.setdefault(methods, (methods, frozenset(methods)))
+	return entry
 
 #Bulb class
 class YeeBulb:
@@ -7,9 +31,29 @@ class YeeBulb:
 	All functions return a tuple: result_tup(x, y)
 	x - True|False depending whether the function executed successfully
 	y - List of requested params|"ok"|error message
+	Instances are slotted for fleet-sized registries: bulbs with the same "support" line share one
+	method set and the state cache has a fixed layout (YeeState). An idle bulb, state cached and no
+	connection open, stays within MEMORY_LIMIT bytes; YeeBenchmark "memory" measures it.
+	Open connections add their socket buffers, coalescing adds the command queue.
+	The settings below are class-wide (e.g. YeeBulb.CALL_TIMEOUT = 10); slotted instances cannot override them.
 	"""
+	__slots__ = ("id", "ip", "port", "model", "name", "methods", "method_set", "cmd_id", "hw_id", "last_seen",
+		"pool", "pipe", "music", "coalesce", "_queue", "limiter", "breaker", "state", "_lock")
 	DISPLAY_MSG = True		#Turn on/off YeeBulb messages
 	HANDLE_RESPONSE = True  #Turn on/off handling response messages
+	STATE_MAX_AGE = 10		#Cached property values younger than this (s) are returned by get_state()
+	AUTO_MUSIC = False		#Switch to music mode when commands queue up behind the quota
+	MUSIC_BYPASS = ["get_prop", "cron_get", "set_music"] #Methods that need a reply, never sent over the music channel
+	QUOTA_BYPASS = ["set_music"] #Methods sent without waiting for the quota, so music mode starts ahead of queued commands
+	CONNECT_TIMEOUT = 2.0	#Time limit (s) for getting a connection, including the TCP handshake
+	REPLY_TIMEOUT = 2.0		#Time limit (s) for the bulb's reply once the request is sent
+	CALL_TIMEOUT = 6.0		#Deadline (s) for a whole operate() call, retries included
+	RETRIES = 2				#Extra attempts for IDEMPOTENT methods after a timeout or a lost connection
+	RETRY_BACKOFF = 0.1		#Delay (s) before the first retry, doubled for every further one, +-50% jitter
+	#Methods that can be resent without changing the outcome (toggle, set_adjust, start_cf, cron_add and set_music can not)
+	IDEMPOTENT = frozenset(["get_prop", "set_default", "set_power", "set_bright", "set_ct_abx", "set_rgb", "set_hsv",
+		"set_scene", "set_name", "stop_cf", "cron_get", "cron_del"])
+	MEMORY_LIMIT = 4096		#Bytes per idle bulb, see the class docstring
 	supported_properties = ["power", "bright", "ct", "rgb", "hue", "sat", "color_mode", "flowing", "delayoff", "flow_params", "music_on", "name"]
 	def __init__(self, bulb_id, bulb_ip, bulb_port, model, name, methods):
 		self.id = bulb_id
@@ -17,8 +61,38 @@ class YeeBulb:
 		self.port = bulb_port
 		self.model = model
 		self.name = name #Could be used instead of id to represent the bulb
-		self.methods = methods
+		self.methods, self.method_set = intern_methods(methods) #Shared, ordered for display and set for lookups
 		self.cmd_id = int(0)
+		self.hw_id = None #Hardware id from the search response, set by BulbRegistry
+		self.last_seen = time.monotonic() #Last time we heard from the bulb, see touch()
+		self.pool = YeeConnectionPool(bulb_ip, bulb_port, timeout = YeeBulb.CONNECT_TIMEOUT, on_message = self.handle_message) #Long-lived connections reused by operate()
+		self.pipe = None #Connection in pipelined mode, see submit()
+		self.music = None #YeeMusicChannel while music mode is on
+		self.coalesce = False #Send commands through 'queue', superseded writes are dropped
+		self._queue = None #YeeCommandQueue, created on first use
+		self.limiter = YeeRateLimiter(on_burst = self.handle_burst) #Per-bulb command quota, see limiter.stats()
+		self.breaker = YeeCircuitBreaker(trial_timeout = YeeBulb.CALL_TIMEOUT) #Fails calls fast while the bulb does not respond
+		self.state = YeeState() #Local state cache, kept current by props notifications
+		self._lock = threading.Lock()
+
+	def update_info(self, response):
+		"""
+		Updates a known bulb in place from a parsed search response (see YeeDiscovery),
+		keeping its connections, state cache and cmd_id counter.
+		A changed address closes the old connections, a bulb closed by close() is reopened.
+		"""
+		if response["ip"] != self.ip or response["port"] != self.port:
+			self.end_pipeline()
+			self.stop_music()
+			self.pool.close()
+			self.ip = response["ip"]
+			self.port = response["port"]
+		if self.pool.closed:
+			self.reopen()
+		self.model = response["model"]
+		self.name = response["name"]
+		self.methods, self.method_set = intern_methods(response["support"])
+		self.update_state(response["props"])
 
 	@classmethod
 	def display(cls, 	msg):
@@ -26,102 +100,485 @@ class YeeBulb:
  			print(msg)
 
 	def supports_method(self, method):
-		if method in self.methods:
-			return True
-		else:
-			return False
+		return method in self.method_set
+
+	@property
+	def queue(self):
+		"""Coalescing command queue, see operate()"""
+		if self._queue is None:
+			with self._lock:
+				if self._queue is None:
+					self._queue = YeeCommandQueue(self.dispatch)
+		return self._queue
+
+	def done(self, result):
+		"""
+		Returns a result produced without talking to the bulb (e.g. failed range check).
+		Subclasses with a different calling convention (AsyncYeeBulb) override this.
+		"""
+		return result
 
 	def next_id(self):
 		"""Creates an Id to help request sender to correlate request and response"""
-		self.cmd_id += 1
-		return self.cmd_id
+		with self._lock:
+			self.cmd_id += 1
+			return self.cmd_id
 
 	def info(self):
 		"""Returns bulb information"""
-		#Including local info
+		#Collecting local states
+		return self.format_info(self.get_state(YeeBulb.supported_properties))
+
+	def format_info(self, response):
+		"""
+		Builds the info() text from a get_state() response.
+		When the bulb did not answer, the last known values are shown and marked stale.
+		"""
 		info = ("Id = " + str(self.id)
 				+"\nIP = " + str(self.ip)
 				+"\nPort = " + str(self.port) 
 				+"\nModel = " + str(self.model))
-		#Collecting local states
-		response = self.get_state(YeeBulb.supported_properties)
-		current_states = response[1]
-
-		for prop, state in zip(YeeBulb.supported_properties, current_states):
-			info += "\n" + prop + " = " + state
+		if response[0]:
+			states = response[1]
+		else:
+			info += "\nState unavailable: " + str(response[1])
+			states = self.last_state(YeeBulb.supported_properties)
+			if any(state is not None for state in states):
+				info += "\nLast known state (stale, " + str(int(self.state_age())) + " s old):"
+			else:
+				states = []
+		for prop, state in zip(YeeBulb.supported_properties, states):
+			info += "\n" + prop + " = " + str(state)
 		#Adding supported methods
 		info += "\nMethods =\n"
 		for i in range(0, len(self.methods)):
 			info+="\t"+self.methods[i]+"\n"
 		return info
 
-	@staticmethod
-	def get_val(data, param):
-		"""	Match line of 'param = value' """
-		param_re = re.compile(param)
-		match = param_re.search(data)
-		value = ""
-		if match != None:
-			value = match.group(1)
-			return value
+	def describe(self, response):
+		"""
+		Machine-readable counterpart of format_info(): a dict with the bulb's info and state.
+		"stale" is True when 'response' failed and the state comes from the cache.
+		"""
+		stale = not response[0]
+		states = self.last_state(YeeBulb.supported_properties) if stale else response[1]
+		age = self.state_age() if stale else 0.0
+		return {
+			"id": self.id,
+			"hw_id": self.hw_id,
+			"ip": self.ip,
+			"port": self.port,
+			"model": self.model,
+			"name": self.name,
+			"stale": stale,
+			"age": round(age, 3) if age != float("inf") else None, #Seconds, None if nothing is known
+			"error": str(response[1]) if stale else None,
+			"state": dict(zip(YeeBulb.supported_properties, states)),
+			"methods": list(self.methods),
+		}
+
+	def last_state(self, req_params):
+		"""Last known values of 'req_params' from the state cache however old, None where unknown"""
+		return [self.state.get(prop) for prop in req_params]
+
+	def state_age(self):
+		"""Seconds since the state cache was last updated"""
+		last = self.state.last_update()
+		if last == NEVER:
+			return float("inf")
+		return time.monotonic() - last
 
 	@staticmethod
-	def handle_result_message(method, data):
+	def handle_result_message(method, frame):
 		"""
 		Method to handle the bulb's response to operation request.
+		'frame' is the parsed reply (dict), see YeeProtocol.result_from_frame().
 		"""
-		print(data)
-		if '"error"' in data:
-			#respose = (False, YeeBulb.get_val(data, '"message":(.*)\}\}'))
-			print("yee")
-		elif method == "get_prop":
-			result = YeeBulb.get_val(data, '"result":\[([ -~]*)\]\}').replace('"', '') #Retrieve the result and remove quotes
-			response = (True, result.split(','))
-		elif '"ok"' in data:
-			response = (True, "ok")
-		else:
-			response = (False, "Unknown error.\n Received data:\n" + data)
-		return response
+		YeeBulb.display(frame)
+		return result_from_frame(method, frame)
+
+	def handle_reply(self, method, frame):
+		self.touch()
+		return YeeBulb.handle_result_message(method, frame)
+
+	def touch(self):
+		"""Records traffic from the bulb (liveness)"""
+		self.last_seen = time.monotonic()
+
+	def handle_message(self, frame):
+		"""Handles frames that are not replies to a request, e.g. props notifications"""
+		self.touch()
+		if is_notification(frame):
+			YeeBulb.display(frame)
+			params = frame.get("params")
+			if isinstance(params, dict):
+				self.update_state(params)
+
+	def handle_burst(self):
+		"""Called by the rate limiter when commands queue up behind the quota"""
+		if YeeBulb.AUTO_MUSIC:
+			YeeBulb.display("Command burst, switching to music mode")
+			self.set_music(1)
+
+	def in_music(self):
+		return self.music is not None
+
+	def update_state(self, props):
+		"""Stores reported property values {prop: value} in the state cache"""
+		now = time.monotonic()
+		for prop, value in props.items():
+			self.state.set(prop, convert_prop(prop, value), now)
+
+	def cached_state(self, req_params, max_age = None):
+		"""
+		Returns the cached values of 'req_params' if all are younger than 'max_age' (s), else None.
+		Always None in music mode: the bulb reports nothing and music channel writes get no reply.
+		"""
+		if self.music is not None:
+			return None
+		if max_age is None:
+			max_age = YeeBulb.STATE_MAX_AGE
+		self.pool.poll() #Apply notifications waiting on idle connections
+		oldest = time.monotonic() - max_age
+		values = []
+		for prop in req_params:
+			if self.state.updated(prop) < oldest:
+				return None
+			values.append(self.state.get(prop))
+		return values
  
 	def operate(self, method, params):
 		"""
 		Input data 'params' must be a compiled into one string.
 		E.g. params="1"; params="\"smooth\"", params="1,\"smooth\",80"
+		a tuple of values, e.g. (1, quoted("smooth"), 80), formatted straight into the request bytes,
+		or the bytes of a precompiled request, see YeeProtocol.encode_request().
 		E.x. { "id": 1, "method": "set_power", "params":["on", "smooth", 500]}
+		With 'coalesce' on, set_bright/set_rgb/set_hsv/set_ct_abx return (True, "queued") at once
+		and may be replaced by a newer value before they are sent, other commands wait in order.
 		"""
 		YeeBulb.display("\nOperating")
 		if not self.supports_method(method):
 			YeeBulb.display("ERROR\nMethod is not supported.")
-		else:
+			return (False, "Method is not supported")
+		if self.coalesce:
+			future = self.queue.put(method, params)
+			if method in COALESCE_KEYS:
+				return (True, "queued") #Fire and forget, a newer value may replace it
+			return future.result()
+		return self.dispatch(method, params)
+
+	def dispatch(self, method, params):
+		"""
+		Sends a command right away through music mode, the pipelined connection or the pool.
+		Every attempt has CONNECT_TIMEOUT to connect and REPLY_TIMEOUT for the reply, all within CALL_TIMEOUT
+		counted from the end of the first quota wait.
+		IDEMPOTENT methods are retried with jittered backoff after a timeout or a lost connection,
+		as long as the backoff and the retry's quota wait end before the deadline.
+		While the circuit breaker is open the call fails at once.
+		"""
+		trace = None
+		metrics = YeeMetrics.collector
+		if metrics is not None:
+			trace = metrics.trace(self, method)
+		if self.music is not None and method not in YeeBulb.MUSIC_BYPASS:
+			result = self.music_request(method, params, trace)
+			if result is not None:
+				return result if trace is None else trace.finish(result)
+		if not self.breaker.allow():
+			result = (False, "Bulb is not responding (circuit open)")
+			return result if trace is None else trace.finish(result)
+		deadline = None
+		attempt = 0
+		bypass = method in YeeBulb.MUSIC_BYPASS
+		while True:
+			if method in YeeBulb.QUOTA_BYPASS:
+				self.limiter.force()
+			elif deadline is None:
+				self.limiter.acquire(until = None if bypass else self.in_music) #Wait for a slot within the bulb's quota
+			elif self.limiter.acquire(deadline - time.monotonic(), None if bypass else self.in_music) is None:
+				self.breaker.failure() #No slot for the retry before the deadline, keep the last error
+				break
+			if deadline is None:
+				deadline = time.monotonic() + YeeBulb.CALL_TIMEOUT #The quota wait is not part of the call's time limit
+			if trace is not None:
+				trace.mark("quota")
+			if self.music is not None and not bypass:
+				#Music mode came on while waiting, e.g. handle_burst()
+				result = self.music_request(method, params, trace)
+				if result is not None:
+					break
+			msg_id = self.next_id()
+			data = encode_request(msg_id, method, params)
 			try:
-				tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-				YeeBulb.display("connecting " + self.ip +" "+ self.port +"...")
-				tcp_socket.connect((self.ip, int(self.port)))
-				msg="{\"id\":" + str(self.next_id()) + ",\"method\":\""
-				msg += method + "\",\"params\":[" + params + "]}\r\n"
-				tcp_socket.send(msg.encode())
-
-				if YeeBulb.HANDLE_RESPONSE:
-					YeeBulb.display("Handling response")
-					DataBytes = tcp_socket.recv(2048)
-					data = DataBytes.decode()#Decode bytes->str
-					result = YeeBulb.handle_result_message(method, data)
+				if self.pipe is not None:
+					result = self.pipeline_reply(method, msg_id, data, deadline, trace)
 				else:
-					result = (True, "")
-				tcp_socket.close()
-				return result
+					result = self.request(method, msg_id, data, trace, deadline)
+				self.breaker.success()
+				break
+			except (OSError, FutureTimeoutError) as e: #Timeouts and connection errors
+				YeeBulb.display("Unexpected error:" + str(e))
+				result = (False, e)
+				delay = self.retry_delay(method, attempt, deadline)
+				if delay is None:
+					self.breaker.failure()
+					break
+				attempt += 1
+				if trace is not None:
+					trace.retries += 1
+				time.sleep(delay)
 			except Exception as e:
-				YeeBulb.display("Unexpected error:" + e)
-				return (False, e)
+				YeeBulb.display("Unexpected error:" + str(e))
+				result = (False, e)
+				self.breaker.failure() #Also ends a half open trial
+				break
+		if trace is not None:
+			trace.finish(result)
+		return result
+
+	def retry_delay(self, method, attempt, deadline):
+		"""Backoff (s) before retrying a failed attempt, None if the call must not be retried"""
+		if method not in YeeBulb.IDEMPOTENT or attempt >= YeeBulb.RETRIES:
+			return None
+		delay = YeeBulb.RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+		if time.monotonic() + delay >= deadline:
+			return None
+		return delay
 
-	def get_state(self, req_params):
-		"""	Method to retrieve current state of specified bulb parameters	"""
+	def budget(self, timeout, deadline):
+		"""Time (s) a step may take: 'timeout', cut short by the call's deadline"""
+		left = deadline - time.monotonic()
+		if left <= 0:
+			raise TimeoutError("Deadline exceeded for " + self.ip)
+		return min(timeout, left)
+
+	def music_request(self, method, params, trace = None):
+		"""
+		Sends a command through the music channel: no reply handling, no quota.
+		Returns None if the channel broke, music mode is then off and the caller falls back to the normal path.
+		"""
+		channel = self.music
+		try:
+			data = encode_request(self.next_id(), method, params)
+			channel.send(data)
+			if trace is not None:
+				trace.bytes_sent = len(data)
+				trace.mark("send")
+			return (True, "")
+		except (OSError, AttributeError) as e:
+			YeeBulb.display("Music mode lost:" + str(e))
+			if self.music is channel:
+				self.music = None
+			channel.close()
+			return None
+
+	def submit(self, method, params):
+		"""
+		Pipelined version of operate().
+		Sends the request without waiting for the bulb and returns a concurrent.futures.Future
+		resolving to the usual result tuple. Replies are matched to requests by their "id",
+		so many commands can be in flight on one connection.
+		The first call switches the bulb to pipelined mode; operate() then uses the same connection.
+		The future fails with TimeoutError if the reply does not come within REPLY_TIMEOUT (and CALL_TIMEOUT).
+		"""
+		if not self.supports_method(method):
+			future = Future()
+			future.set_result((False, "Method is not supported"))
+			return future
+		if self.coalesce:
+			return self.queue.put(method, params)
+		trace = None
+		metrics = YeeMetrics.collector
+		if metrics is not None:
+			trace = metrics.trace(self, method)
+		if self.music is not None and method not in YeeBulb.MUSIC_BYPASS:
+			result = self.music_request(method, params, trace)
+			if result is not None:
+				future = Future()
+				future.set_result(result if trace is None else trace.finish(result))
+				return future
+		if not self.breaker.allow():
+			result = (False, "Bulb is not responding (circuit open)")
+			future = Future()
+			future.set_result(result if trace is None else trace.finish(result))
+			return future
+		self.limiter.acquire()
+		deadline = time.monotonic() + YeeBulb.CALL_TIMEOUT
+		if trace is not None:
+			trace.mark("quota")
+		msg_id = self.next_id()
+		data = encode_request(msg_id, method, params)
+		try:
+			future = self.pipeline_request(method, msg_id, data, deadline, trace)
+		except Exception as e:
+			self.breaker.failure()
+			future = Future()
+			future.set_result((False, e) if trace is None else trace.finish((False, e)))
+			return future
+		future.add_done_callback(self.record_outcome)
+		if trace is None:
+			return future
+		return trace.finish_future(future)
+
+	def record_outcome(self, future):
+		"""Feeds the circuit breaker with the outcome of a submit() future"""
+		if future.exception() is None:
+			self.breaker.success()
+		else:
+			self.breaker.failure()
+
+	def pipeline_reply(self, method, msg_id, data, deadline, trace = None):
+		"""Sends over the pipelined connection and waits for the reply within REPLY_TIMEOUT"""
+		future = self.pipeline_request(method, msg_id, data, deadline, trace)
+		try:
+			result = future.result(self.budget(YeeBulb.REPLY_TIMEOUT, deadline))
+			if trace is not None:
+				trace.mark("wait")
+			return result
+		except FutureTimeoutError:
+			pipe = self.pipe
+			if pipe is not None:
+				pipe.forget(msg_id)
+			raise TimeoutError("No reply from " + self.ip)
+
+	def pipeline_request(self, method, msg_id, data, deadline = None, trace = None):
+		"""
+		Sends an encoded request over the pipelined connection, (re)opening it when needed.
+		Opening the connection may take CONNECT_TIMEOUT, the reply REPLY_TIMEOUT, both within 'deadline'
+		(time.monotonic(), default CALL_TIMEOUT from now); the reader fails the future after that.
+		'trace' gets the connect and send phases.
+		"""
+		if deadline is None:
+			deadline = time.monotonic() + YeeBulb.CALL_TIMEOUT
+		with self._lock:
+			if self.pipe is None or not self.pipe.reading:
+				if self.pipe is not None:
+					self.pool.release(self.pipe, broken = True)
+					self.pipe = None
+				YeeBulb.display("connecting " + self.ip +" "+ self.port +" (pipelined)...")
+				self.pipe = self.pool.acquire(self.budget(YeeBulb.CONNECT_TIMEOUT, deadline))
+				self.pipe.start_reader()
+			pipe = self.pipe
+		if trace is not None:
+			trace.mark("connect")
+		if not YeeBulb.HANDLE_RESPONSE:
+			pipe.send(data)
+			future = Future()
+			future.set_result((True, ""))
+		else:
+			reply_deadline = time.monotonic() + self.budget(YeeBulb.REPLY_TIMEOUT, deadline)
+			future = pipe.submit(msg_id, data, lambda reply: self.handle_reply(method, reply), reply_deadline)
+		if trace is not None:
+			trace.bytes_sent = len(data)
+			trace.mark("send")
+		return future
+
+	def end_pipeline(self):
+		"""Leaves pipelined mode and closes its connection, later commands use the pool again"""
+		with self._lock:
+			pipe = self.pipe
+			self.pipe = None
+		if pipe is not None:
+			self.pool.release(pipe, broken = True) #Reader thread still owns the socket
+
+	def request(self, method, msg_id, data, trace = None, deadline = None):
+		"""
+		Sends an encoded request over a pooled connection and handles the reply.
+		A reused connection that turns out to be dead is reopened and the request resent once.
+		'trace' - YeeMetrics.CommandTrace timing the phases, None when metrics are off
+		'deadline' - time.monotonic() limit of the call, see dispatch()
+		"""
+		if deadline is None:
+			deadline = time.monotonic() + YeeBulb.CALL_TIMEOUT
+		conn = self.pool.acquire(self.budget(YeeBulb.CONNECT_TIMEOUT, deadline))
+		try:
+			if trace is not None:
+				trace.mark("connect")
+				received = conn.bytes_received
+			if conn.uses == 0:
+				YeeBulb.display("connecting " + self.ip +" "+ self.port +"...")
+			try:
+				conn.drain() #Drop notifications pushed while the connection was idle
+				conn.send(data)
+			except OSError:
+				if conn.uses == 0:
+					raise
+				YeeBulb.display("reconnecting " + self.ip +" "+ self.port +"...")
+				if trace is not None:
+					trace.retries += 1
+				self.pool.reconnect(conn, self.budget(YeeBulb.CONNECT_TIMEOUT, deadline))
+				conn.send(data)
+			if trace is not None:
+				trace.bytes_sent = len(data)
+				trace.mark("send")
+
+			if YeeBulb.HANDLE_RESPONSE:
+				YeeBulb.display("Handling response")
+				reply = conn.read_reply(msg_id, time.monotonic() + self.budget(YeeBulb.REPLY_TIMEOUT, deadline))
+				if trace is not None:
+					trace.mark("wait")
+				result = self.handle_reply(method, reply)
+				if trace is not None:
+					trace.mark("parse")
+			else:
+				result = (True, "")
+			if trace is not None:
+				trace.bytes_received = conn.bytes_received - received
+		except Exception:
+			self.pool.release(conn, broken = True)
+			raise
+		self.pool.release(conn)
+		return result
+
+	def close(self):
+		"""Closes all connections to the bulb, see reopen()"""
+		if self._queue is not None:
+			self._queue.close()
+			self._queue = None
+		self.stop_music()
+		self.end_pipeline()
+		self.pool.close()
+
+	def reopen(self):
+		"""Makes a closed bulb usable again: a new connection pool, the breaker reset"""
+		if not self.pool.closed:
+			return
+		self.pool = YeeConnectionPool(self.ip, self.port, timeout = YeeBulb.CONNECT_TIMEOUT, on_message = self.handle_message)
+		self.breaker.reset()
+
+	def get_state(self, req_params, max_age = None, refresh = False):
+		"""
+		Method to retrieve current state of specified bulb parameters.
+		Values come back typed: ints for bright/ct/rgb/..., strings for power/name, None if not available.
+		Answered from the local state cache when every requested value is younger than
+		'max_age' seconds (default STATE_MAX_AGE), refresh=True always asks the bulb.
+		"""
+		if not refresh:
+			cached = self.cached_state(req_params, max_age)
+			if cached is not None:
+				return self.done((True, cached))
+		return self.store_state(req_params, self.operate("get_prop", YeeBulb.prop_params(req_params)))
+
+	@staticmethod
+	def prop_params(req_params):
+		"""Builds the get_prop params string"""
 		params = ""
 		for i in range(0, len(req_params)):
 			params += "\"" + req_params[i] + "\""
 			if i != len(req_params) - 1:
 				params +=","
-		return self.operate("get_prop", params)
+		return params
+
+	def store_state(self, req_params, response):
+		"""Types a get_prop response and stores the values in the state cache"""
+		if response[0]:
+			values = convert_props(req_params, response[1])
+			now = time.monotonic()
+			for prop, value in zip(req_params, values):
+				self.state.set(prop, value, now)
+			return (True, values)
+		return response
 
 	def set_ct(self, ct_value, effect = "sudden", duration = 30):
 		"""
@@ -131,10 +588,9 @@ class YeeBulb:
 		duration - total time of gradual change if smooth mode is selected (duration > 30 (ms))
 		"""	
 		if 1700 <= int(ct_value) <= 6500 and int(duration) >= 30:
-			params = str(ct_value) +",\"" + str(effect) + "\"," + str(duration)
-			return self.operate("set_ct_abx", params)
+			return self.operate("set_ct_abx", (ct_value, quoted(effect), duration))
 		else:
-			return (False, "Parameters out of range")
+			return self.done((False, "Parameters out of range"))
 
 	def set_rgb(self, rgb_value, effect = "sudden", duration = 30):
 		"""
@@ -142,10 +598,9 @@ class YeeBulb:
 		rgb_value - the target color (decimal int;  0 <= rgb_value <= 16777215)
 		"""
 		if 0 <= int(rgb_value) <= 16777215 and int(duration) >= 30:
-			params = str(rgb_value) +",\"" + str(effect) + "\"," + str(duration)
-			return self.operate("set_rgb", params)
+			return self.operate("set_rgb", (rgb_value, quoted(effect), duration))
 		else:
-			return (False, "Parameters out of range")
+			return self.done((False, "Parameters out of range"))
 
 	def set_hue(self, hue, sat = 0, effect = "sudden", duration = 30):
 		"""
@@ -153,10 +608,9 @@ class YeeBulb:
 		sat - target saturation value (int; 0 <= sat <= 100)
 		"""
 		if 0 <= int(hue) <= 359 and 0 <= int(sat) <= 100 and int(duration) >= 30:
-			params = str(hue) + "," + str(sat) +",\"" + str(effect) + "\"," + str(duration)
-			return self.operate("set_hsv", params)
+			return self.operate("set_hsv", (hue, sat, quoted(effect), duration))
 		else:
-			return (False, "Parameters out of range")
+			return self.done((False, "Parameters out of range"))
 
 	def set_bright(self, bright, effect = "sudden", duration = 30):
 		"""
@@ -164,28 +618,25 @@ class YeeBulb:
 		bright - target brightness (1 <= bright <= 100)
 		"""
 		if (1 <= int(bright) <= 100) and (int(duration) >= 30):
-			params = str(bright) + ",\"" + str(effect) + "\"," + str(duration)
-			return self.operate("set_bright", params)
+			return self.operate("set_bright", (bright, quoted(effect), duration))
 		else:
-			return (False, "Parameters out of range")
+			return self.done((False, "Parameters out of range"))
 	
 	def turn_on(self, effect = "sudden", duration = 30):
 		""" Method to turn on the bulb. """
-		params = "\"on\"" + ",\"" + str(effect) + "\"," + str(duration)
-		self.operate("set_power", params)
+		return self.operate("set_power", (quoted("on"), quoted(effect), duration))
 
 	def turn_off(self, effect = "sudden", duration = 30):
 		""" Method to turn off the bulb. """
-		params = "\"off\"" + ",\"" + str(effect) + "\"," + str(duration)
-		self.operate("set_power", params)
+		return self.operate("set_power", (quoted("off"), quoted(effect), duration))
 
 	def toggle(self):
 		""" Toggles on/off. """
-		self.operate("toggle", "")
+		return self.operate("toggle", "")
 
 	def set_default(self):
 		"""Sets current bulb state as default. """
-		self.operate("set_default", "")
+		return self.operate("set_default", "")
 
 	#NOT TESTED
 	def start_cf(self, count, action, *flow_expressions):
@@ -201,23 +652,33 @@ class YeeBulb:
 				0 means smart LED recover to the state before the color flow started.
 				1 means smart LED stay at the state when the flow is stopped.
 				2 means turn off the smart LED after the flow is stopped.
-			flow_expression: the expression of the state changing series. [duration, mode, value, brightness]
+			flow_expressions: the state changing series, one (duration, mode, value, brightness) tuple per step.
 				duration: Gradual change time or sleep time in milliseconds, minimum value 50.
 				mode: 1 – color, 2 – color temperature, 7 -- sleep.
 				value: RGB value when mode is 1, CT value when mode is 2, ignored when mode is 7.
-				brightness: Brightness value, 1 ~ 100. Ignored when mode is 7.
+				brightness: Brightness value, 1 ~ 100 or -1 to keep it. Ignored when mode is 7.
 		Request Example: 
 		{"id":1,"method":"start_cf","params":[ 4, 2, "1000, 2, 2700, 100, 500, 1,255, 10, 5000, 7, 0,0, 500, 2, 5000, 1"]
+		Steps are sent as given, see start_flow() for building and reusing flows.
 		"""
-		if (flow_expressions % 4 == 0) and (flow_expressions / 4 == count): #Check if "flow_expressions" corelate with "count"
-			params = str(count) +"," + str(action) + ","
-			params += '"' + flow_expressions[0]
-			for expression in flow_expressions[1:]:
-				params += ', ' + expression
-			params += '"'
-			return self.operate("start_cf", params )
-		else:
-			return (False, "Incorect parameters")
+		try:
+			if int(action) not in (ACTION_RECOVER, ACTION_STAY, ACTION_OFF) or int(count) < 0 or not flow_expressions:
+				return self.done((False, "Incorect parameters"))
+			steps = [check_step(*expression) for expression in flow_expressions]
+		except (TypeError, ValueError) as e:
+			return self.done((False, "Incorect parameters: " + str(e)))
+		return self.operate("start_cf", flow_params(count, action, steps))
+
+	def start_flow(self, flow):
+		"""
+		Starts a YeeFlow.Flow. The flow is compiled once and the cached params are reused,
+		so the same Flow can be started on many bulbs (e.g. through a BulbGroup).
+		"""
+		try:
+			params = flow.compile()
+		except ValueError as e:
+			return self.done((False, str(e)))
+		return self.operate("start_cf", params)
 	
 	def stop_cf(self):
 		""" Method to stop the color flow """
@@ -228,23 +689,40 @@ class YeeBulb:
 		This method is used to set the smart LED directly to specified state.
 		If the smart LED is off, then it will turn on the smart LED firstly and then apply the specified command.
 		Args:
-			class_type: "color", "hsv", "ct", "cf", "auto_dealy_off".
+			class_type: "color", "hsv", "ct", "cf", "auto_delay_off".
 				"color": change the smart LED to specified color and brightness.
 				"hsv": change the smart LED to specified color and brightness.
 				"ct": change the smart LED to specified ct and brightness.
 				"cf": start a color flow in specified fashion.
 				"auto_delay_off": turn on the smart LED to specified brightness and start a sleep timer to turn off the light after the specified time
 			args: class specific.
+				"color": rgb (0 ~ 16777215), bright (1 ~ 100)
+				"hsv": hue (0 ~ 359), sat (0 ~ 100), bright (1 ~ 100)
+				"ct": ct (1700 ~ 6500), bright (1 ~ 100)
+				"cf": count, action, flow expressions as in start_cf(), or one YeeFlow.Flow
+				"auto_delay_off": bright (1 ~ 100), minutes (>= 1)
+		Request Example:
+		{"id":1,"method":"set_scene","params":["ct", 5400, 100]}
+		See recall_scene() for named scenes that are validated and encoded once.
 		"""
-		#TODO check if arg is in range for specific class_type
-		class_list =["color", "hsv", "ct", "cf", "auto_delay_off"]
-		if class_type in class_list:
-			params = str(class_type)
-			for arg in args:
-				param += str(arg) + ','
-			return self.operate("set_scene", params)
-		else:
-			return (False, "Parameters out of range")
+		try:
+			params = scene_params(class_type, *args)
+		except (TypeError, ValueError) as e:
+			return self.done((False, "Parameters out of range: " + str(e)))
+		return self.operate("set_scene", params)
+
+	def recall_scene(self, name, library = None):
+		"""
+		Sets the named scene from 'library' (default YeeScene.scenes), see YeeScene.SceneLibrary.
+		The request bytes are compiled once and shared by all bulbs.
+		"""
+		if library is None:
+			library = scenes
+		try:
+			payload = library.payload(name)
+		except KeyError:
+			return self.done((False, "Unknown scene " + str(name)))
+		return self.operate("set_scene", payload)
 
 	def cron_add(self, value, mode = 0):
 		"""
@@ -290,7 +768,7 @@ class YeeBulb:
 		params = str(action) + ',' + str(prop)
 		return self.operate("set_adjust", params)
 
-	def set_music(self, action, host, port):
+	def set_music(self, action, host = None, port = 0):
 		"""
 		This method is used to start or stop music mode on a device. Under music mode, no property will be reported and no message quota is checked.
 		Args:
@@ -308,19 +786,48 @@ class YeeBulb:
 			send all supported commands through this channel without any limits to simulate any music effect.
 			The control device can stop music mode by explicitly sending a stop command or by closing the socket.
 
-		TEMP Notes:
-			*possibly create a new thread pointing to music_mode()
-			*split set_music() into music_mode_start() and music_mode_stop()
+		Here the TCP server is started for you (YeeMusicChannel), 'host' defaults to the local address
+		the bulb can reach and 'port' to any free port. While music mode is on, operate() sends
+		commands through the music channel without waiting for replies and without the quota.
 		"""
-		pass
 		#Turn music mode on
 		if int(action) == 1:
-			YeeBulb.DISPLAY_MSG = False		#Turn off YeeBulb messages
-			YeeBulb.HANDLE_RESPONSE = False #Turn off handling response messages
+			if self.music is not None:
+				return self.done((True, "ok"))
+			if not self.supports_method("set_music"):
+				return self.done((False, "Method is not supported"))
+			channel = YeeMusicChannel(self.ip, host, port)
+			try:
+				host, port = channel.listen()
+				#Not through the coalescing queue: handle_burst() may run on its worker
+				result = self.dispatch("set_music", "1,\"" + str(host) + "\"," + str(port))
+				if result[0]:
+					channel.accept()
+					self.music = channel
+					self.limiter.wake() #Commands waiting for the quota go through the channel now
+					YeeBulb.display("Music mode on " + str(host) + ":" + str(port))
+					return result
+				channel.close()
+				return result
+			except Exception as e:
+				channel.close()
+				YeeBulb.display("Music mode failed:" + str(e))
+				return (False, e)
 		#Turn music mode off
 		else:
-			YeeBulb.DISPLAY_MSG = True		#Turn on YeeBulb messages
-			YeeBulb.HANDLE_RESPONSE = True  #Turn on handling response messages
+			self.stop_music()
+			return self.done((True, "ok"))
+
+	def stop_music(self):
+		"""Sends the stop command through the music channel and closes it"""
+		channel = self.music
+		self.music = None
+		if channel is not None:
+			try:
+				channel.send(b"{\"id\":" + str(self.next_id()).encode() + b",\"method\":\"set_music\",\"params\":[0]}\r\n")
+			except OSError:
+				pass
+			channel.close()
 
 	def set_name(self, name):
 		"""
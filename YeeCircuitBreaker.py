@@ -0,0 +1,62 @@
+import threading
+import time
+
+#Circuit breaker class
+class YeeCircuitBreaker:
+	"""
+	Per-bulb circuit breaker.
+	After 'threshold' consecutive failed calls (timeouts, refused or dropped connections) the circuit
+	opens and calls fail at once instead of each waiting out its timeout. After 'reset_timeout' seconds
+	one trial call is let through (half open): success closes the circuit, failure opens it again.
+	A trial that reports neither within 'trial_timeout' seconds (e.g. a reply that never came)
+	counts as a failure, so a lost trial cannot keep the circuit half open for good.
+	Error replies from the bulb (e.g. quota exceeded) prove it is reachable and count as success.
+	"""
+	__slots__ = ("threshold", "reset_timeout", "trial_timeout", "state", "failures", "opened", "trial_started",
+		"rejected", "_lock")
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half_open"
+
+	def __init__(self, threshold = 3, reset_timeout = 30.0, trial_timeout = 10.0):
+		self.threshold = threshold
+		self.reset_timeout = reset_timeout
+		self.trial_timeout = trial_timeout
+		self.state = YeeCircuitBreaker.CLOSED
+		self.failures = 0 #Consecutive failures
+		self.opened = 0.0 #time.monotonic() when the circuit opened
+		self.trial_started = 0.0 #time.monotonic() when the half open trial went out
+		self.rejected = 0 #Calls failed fast while open
+		self._lock = threading.Lock()
+
+	def allow(self):
+		"""True if a call may go out now"""
+		with self._lock:
+			if self.state == YeeCircuitBreaker.CLOSED:
+				return True
+			now = time.monotonic()
+			if self.state == YeeCircuitBreaker.HALF_OPEN and now - self.trial_started >= self.trial_timeout:
+				self.state = YeeCircuitBreaker.OPEN #The trial never reported back
+				self.opened = self.trial_started + self.trial_timeout
+			if self.state == YeeCircuitBreaker.OPEN and now - self.opened >= self.reset_timeout:
+				self.state = YeeCircuitBreaker.HALF_OPEN
+				self.trial_started = now
+				return True #The trial call
+			self.rejected += 1
+			return False
+
+	def success(self):
+		with self._lock:
+			self.failures = 0
+			self.state = YeeCircuitBreaker.CLOSED
+
+	def failure(self):
+		with self._lock:
+			self.failures += 1
+			if self.state == YeeCircuitBreaker.HALF_OPEN or self.failures >= self.threshold:
+				self.state = YeeCircuitBreaker.OPEN
+				self.opened = time.monotonic()
+
+	def reset(self):
+		"""Closes the circuit, e.g. when the bulb advertises itself again"""
+		self.success()
@@ -0,0 +1,181 @@
+import numpy as np
+
+#Batch color conversion for many bulbs at once (needs NumPy, the rest of the package does not).
+#Every function takes arrays (or anything np.asarray accepts) and returns int64 arrays in the
+#bulb's wire formats, clamped to the ranges the YeeBulb setters accept, so per-frame work for
+#hundreds of bulbs stays out of Python loops:
+#	colors = hsv_to_wire(hues, 100)
+#	group.map("set_rgb", colors)
+
+#----------Variables----------
+#Ranges enforced by the YeeBulb setters (inclusive)
+RGB_MAX = 16777215
+HUE_RANGE = (0, 359)
+SAT_RANGE = (0, 100)
+CT_RANGE = (1700, 6500)
+BRIGHT_RANGE = (1, 100)
+#ASCII code -> hex digit value, 255 marks an invalid character
+HEX_TABLE = np.full(256, 255, dtype=np.int64)
+HEX_TABLE[48:58] = np.arange(10) #0-9
+HEX_TABLE[65:71] = np.arange(10, 16) #A-F
+HEX_WEIGHTS = 16 ** np.arange(5, -1, -1, dtype=np.int64)
+
+def clamp(values, bounds):
+	"""Rounds to integers and clips to the inclusive range 'bounds'"""
+	return np.clip(np.rint(np.asarray(values, dtype=np.float64)), bounds[0], bounds[1]).astype(np.int64)
+
+def clamp_hue(hue):
+	"""Hue wraps around instead of clipping, 360 -> 0"""
+	return np.rint(np.asarray(hue, dtype=np.float64)).astype(np.int64) % 360
+
+def clamp_sat(sat):
+	return clamp(sat, SAT_RANGE)
+
+def clamp_ct(kelvin):
+	"""Kelvin to set_ct values"""
+	return clamp(kelvin, CT_RANGE)
+
+def clamp_bright(bright):
+	return clamp(bright, BRIGHT_RANGE)
+
+def rgb_to_wire(rgb):
+	"""(..., 3) array of 0-255 channels -> set_rgb values"""
+	rgb = clamp(rgb, (0, 255))
+	return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+def wire_to_rgb(values):
+	"""set_rgb values -> (..., 3) array of 0-255 channels"""
+	values = clamp(values, (0, RGB_MAX))
+	return np.stack(((values >> 16) & 255, (values >> 8) & 255, values & 255), axis=-1)
+
+def hex_to_wire(codes):
+	"""
+	"#RRGGBB" or "RRGGBB" strings -> set_rgb values.
+	The digits are decoded through a lookup table on the raw bytes, no per-string int() calls.
+	Raises ValueError for malformed codes.
+	"""
+	codes = np.asarray(codes, dtype=str)
+	shape = codes.shape
+	codes = np.char.upper(np.char.lstrip(np.atleast_1d(codes), "#"))
+	lengths = np.char.str_len(codes)
+	if codes.size and (lengths.min() != 6 or lengths.max() != 6):
+		raise ValueError("Hex colors must have 6 digits")
+	try:
+		raw = codes.astype("S6")
+	except UnicodeEncodeError:
+		raise ValueError("Invalid hex color")
+	digits = HEX_TABLE[raw.view(np.uint8).reshape(codes.shape + (6,))]
+	if (digits == 255).any():
+		raise ValueError("Invalid hex color")
+	return (digits * HEX_WEIGHTS).sum(axis=-1).reshape(shape)
+
+def wire_to_hex(values):
+	"""set_rgb values -> "#RRGGBB" strings"""
+	return np.char.mod("#%06X", clamp(values, (0, RGB_MAX)))
+
+def hsv_to_rgb(hue, sat, value = 100):
+	"""
+	Hue (degrees), saturation and value (0-100, the bulb's units) -> (..., 3) array of 0-255 channels.
+	The arguments broadcast against each other, e.g. an array of hues with one saturation.
+	"""
+	h = (np.asarray(hue, dtype=np.float64) % 360) / 60
+	s = np.clip(np.asarray(sat, dtype=np.float64), 0, 100) / 100
+	v = np.clip(np.asarray(value, dtype=np.float64), 0, 100) / 100 * 255
+	h, s, v = np.broadcast_arrays(h, s, v)
+	sector = np.floor(h)
+	f = h - sector
+	sector = sector.astype(np.int64) % 6
+	p = v * (1 - s)
+	q = v * (1 - s * f)
+	t = v * (1 - s * (1 - f))
+	r = np.choose(sector, [v, q, p, p, t, v])
+	g = np.choose(sector, [t, v, v, q, p, p])
+	b = np.choose(sector, [p, p, t, v, v, q])
+	return clamp(np.stack((r, g, b), axis=-1), (0, 255))
+
+def hsv_to_wire(hue, sat, value = 100):
+	"""Hue, saturation and value -> set_rgb values"""
+	return rgb_to_wire(hsv_to_rgb(hue, sat, value))
+
+def rgb_to_hsv(rgb):
+	"""
+	(..., 3) array of 0-255 channels -> (hue, sat, bright) arrays for set_hue/set_bright.
+	The bulb has no zero brightness, black comes out as bright 1.
+	"""
+	rgb = np.asarray(rgb, dtype=np.float64) / 255
+	r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+	high = rgb.max(axis=-1)
+	delta = high - rgb.min(axis=-1)
+	safe = np.where(delta == 0, 1, delta)
+	hue = np.select([high == r, high == g], [((g - b) / safe) % 6, (b - r) / safe + 2], (r - g) / safe + 4) * 60
+	hue = np.where(delta == 0, 0, hue)
+	sat = np.where(high == 0, 0, delta / np.where(high == 0, 1, high)) * 100
+	return (clamp_hue(hue), clamp_sat(sat), clamp_bright(high * 100))
+
+def wire_to_hsv(values):
+	"""set_rgb values -> (hue, sat, bright) arrays"""
+	return rgb_to_hsv(wire_to_rgb(values))
+
+def kelvin_to_rgb(kelvin):
+	"""
+	Approximate color of a black body at 'kelvin' as (..., 3) 0-255 channels (Tanner Helland's fit),
+	for showing a color temperature on the rgb channel, e.g. in a gradient mixing ct and colors.
+	"""
+	t = np.clip(np.asarray(kelvin, dtype=np.float64), 1000, 40000) / 100
+	warm = t <= 66
+	#The unused branch is still evaluated, keep its arguments in range
+	red = np.where(warm, 255, 329.698727446 * np.maximum(t - 60, 1) ** -0.1332047592)
+	green = np.where(warm, 99.4708025861 * np.log(t) - 161.1195681661, 288.1221695283 * np.maximum(t - 60, 1) ** -0.0755148492)
+	blue = np.where(t >= 66, 255, np.where(t <= 19, 0, 138.5177312231 * np.log(np.maximum(t - 10, 1)) - 305.0447927307))
+	return clamp(np.stack((red, green, blue), axis=-1), (0, 255))
+
+def kelvin_to_wire(kelvin):
+	"""Kelvin -> set_rgb values, see kelvin_to_rgb()"""
+	return rgb_to_wire(kelvin_to_rgb(kelvin))
+
+def interpolate(start, end, t):
+	"""
+	Linear blend start -> end at 't' (0-1). 't' broadcasts against the scenes:
+	a scalar gives one frame, t[:, None] over per-bulb arrays gives a (frames, bulbs) array.
+	"""
+	start = np.asarray(start, dtype=np.float64)
+	end = np.asarray(end, dtype=np.float64)
+	return start + (end - start) * np.asarray(t, dtype=np.float64)
+
+def interpolate_rgb(start, end, t):
+	"""Blends set_rgb values channel by channel"""
+	t = np.asarray(t, dtype=np.float64)[..., None]
+	return rgb_to_wire(interpolate(wire_to_rgb(start), wire_to_rgb(end), t))
+
+def interpolate_hue(start, end, t):
+	"""Blends hues the short way around the color wheel"""
+	start = np.asarray(start, dtype=np.float64)
+	diff = (np.asarray(end, dtype=np.float64) - start + 180) % 360 - 180
+	return clamp_hue(start + diff * np.asarray(t, dtype=np.float64))
+
+def transition(start, end, frames, prop = "bright"):
+	"""
+	(frames, bulbs) array stepping from scene 'start' to scene 'end', both ends included.
+	'prop' - "rgb", "hue", "sat", "ct" or "bright", picks the blend and the clamp range.
+	"""
+	t = np.linspace(0.0, 1.0, frames)[:, None]
+	if prop == "rgb":
+		return interpolate_rgb(start, end, t)
+	if prop == "hue":
+		return interpolate_hue(start, end, t)
+	bounds = {"sat": SAT_RANGE, "ct": CT_RANGE, "bright": BRIGHT_RANGE}[prop]
+	return clamp(interpolate(start, end, t), bounds)
+
+def frame_states(bulbs, **props):
+	"""
+	Per-bulb arrays -> an EffectEngine frame {bulb.id: {prop: value}}, e.g.
+		frame_states(bulbs, rgb = colors, bright = levels)
+	"hsv" takes a (hues, sats) pair. Arrays are converted to Python ints in one go.
+	"""
+	columns = {}
+	for prop, values in props.items():
+		if prop == "hsv":
+			columns[prop] = list(zip(clamp_hue(values[0]).tolist(), clamp_sat(values[1]).tolist()))
+		else:
+			columns[prop] = np.asarray(values).tolist()
+	return {bulb.id: {prop: column[i] for prop, column in columns.items()} for i, bulb in enumerate(bulbs)}
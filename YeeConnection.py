@@ -0,0 +1,328 @@
+import socket
+import select
+import threading
+import time
+from concurrent.futures import Future
+from YeeProtocol import LineReader
+
+#Connection class
+class YeeConnection:
+	"""
+	A single TCP connection to a bulb.
+	The socket stays open between commands so the handshake is paid only once.
+	Frames that are not replies to our requests (props notifications) go to 'on_message'.
+	"""
+	EXPIRE_TICK = 0.25 #Pipelined mode: how often (s) the reader checks for replies past their deadline
+	def __init__(self, ip, port, timeout = None, on_message = None):
+		self.ip = ip
+		self.port = int(port)
+		self.timeout = timeout
+		self.sock = None
+		self.uses = 0 #Number of requests sent over this socket
+		self.last_used = 0.0
+		self.bytes_sent = 0
+		self.bytes_received = 0
+		self.pending = {} #Pipelined mode: {request_id: (future, convert, deadline)}
+		self.reading = False #True while the pipelined reader thread runs
+		self.on_message = on_message
+		self.frames = LineReader()
+		self._lock = threading.Lock()
+
+	def connect(self, timeout = None):
+		"""Opens the TCP socket, 'timeout' (s) overrides the connection's timeout for the handshake"""
+		self.close()
+		self.sock = socket.create_connection((self.ip, self.port), timeout if timeout is not None else self.timeout)
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #Commands are tiny, don't wait for Nagle
+		self.frames.clear()
+		self.uses = 0
+		self.last_used = time.monotonic()
+
+	def close(self):
+		"""Closes the socket, safe to call more than once"""
+		if self.sock is not None:
+			try:
+				self.sock.close()
+			except OSError:
+				pass
+			self.sock = None
+
+	def alive(self):
+		"""
+		Checks an idle connection without blocking.
+		A socket closed by the bulb becomes readable and returns b"" on peek.
+		"""
+		if self.sock is None:
+			return False
+		try:
+			readable, _, _ = select.select([self.sock], [], [], 0)
+			if not readable:
+				return True
+			return len(self.sock.recv(1, socket.MSG_PEEK)) > 0
+		except (OSError, ValueError):
+			return False
+
+	def drain(self):
+		"""Handles everything the bulb pushed while the connection was idle (e.g. props notifications)"""
+		while self.sock is not None:
+			readable, _, _ = select.select([self.sock], [], [], 0)
+			if not readable:
+				break
+			chunk = self.sock.recv(2048)
+			if not chunk:
+				raise ConnectionError("Connection closed by bulb")
+			self.bytes_received += len(chunk)
+			for frame in self.frames.feed(chunk):
+				self.message(frame)
+
+	def send(self, data):
+		"""Sends an encoded request"""
+		with self._lock:
+			self.sock.sendall(data)
+			self.uses += 1
+			self.bytes_sent += len(data)
+			self.last_used = time.monotonic()
+
+	def read_reply(self, msg_id, deadline = None):
+		"""
+		Blocking read of the reply to request 'msg_id'.
+		Handles partial and coalesced reads, frames arriving before the reply go to on_message.
+		'deadline' - time.monotonic() by which the reply must arrive, TimeoutError after that.
+		The bulb answers requests it cannot parse with an error without "id"; on a connection
+		used for one request at a time that error is the reply.
+		"""
+		while True:
+			if deadline is not None:
+				left = deadline - time.monotonic()
+				if left <= 0:
+					raise TimeoutError("No reply from " + self.ip)
+				self.sock.settimeout(left)
+			try:
+				chunk = self.sock.recv(2048)
+			except socket.timeout:
+				raise TimeoutError("No reply from " + self.ip)
+			if not chunk:
+				raise ConnectionError("Connection closed by bulb")
+			self.bytes_received += len(chunk)
+			self.last_used = time.monotonic()
+			reply = None
+			for frame in self.frames.feed(chunk):
+				if reply is None and (frame.get("id") == msg_id or (frame.get("id") is None and "error" in frame)):
+					reply = frame
+				else:
+					self.message(frame)
+			if reply is not None:
+				return reply
+
+	def message(self, frame):
+		if self.on_message is not None:
+			self.on_message(frame)
+
+	def start_reader(self):
+		"""
+		Switches the connection to pipelined mode.
+		A reader thread frames the incoming stream and hands every reply to the future
+		registered under its "id". Other frames (e.g. props notifications) go to on_message.
+		"""
+		if self.reading:
+			return
+		self.sock.settimeout(YeeConnection.EXPIRE_TICK) #Wakes the reader to fail requests past their deadline
+		self.reading = True
+		reader = threading.Thread(target=self._read_loop, daemon=True)
+		reader.start()
+
+	def submit(self, msg_id, data, convert = None, deadline = None):
+		"""
+		Sends a request without waiting for the reply.
+		Returns a Future resolving to convert(reply_frame) (the frame dict if 'convert' is None).
+		The future raises ConnectionError if the connection is lost before the reply arrives,
+		and TimeoutError if no reply came by 'deadline' (time.monotonic(), None - no limit).
+		"""
+		future = Future()
+		with self._lock:
+			if not self.reading:
+				raise ConnectionError("Connection is not in pipelined mode")
+			self.pending[msg_id] = (future, convert, deadline)
+			try:
+				self.sock.sendall(data)
+			except Exception:
+				del self.pending[msg_id]
+				raise
+			self.uses += 1
+			self.bytes_sent += len(data)
+			self.last_used = time.monotonic()
+		return future
+
+	def forget(self, msg_id):
+		"""Stops waiting for the reply to 'msg_id', e.g. after the caller timed out"""
+		with self._lock:
+			self.pending.pop(msg_id, None)
+
+	def expire(self):
+		"""Fails the pipelined requests whose deadline has passed"""
+		now = time.monotonic()
+		with self._lock:
+			expired = [msg_id for msg_id, entry in self.pending.items() if entry[2] is not None and entry[2] <= now]
+			entries = [self.pending.pop(msg_id) for msg_id in expired]
+		for future, convert, deadline in entries:
+			future.set_exception(TimeoutError("No reply from " + self.ip))
+
+	def _read_loop(self):
+		error = ConnectionError("Connection closed by bulb")
+		try:
+			while True:
+				try:
+					chunk = self.sock.recv(4096)
+				except socket.timeout:
+					self.expire()
+					continue
+				if not chunk:
+					break
+				self.bytes_received += len(chunk)
+				self.last_used = time.monotonic()
+				for frame in self.frames.feed(chunk):
+					self._dispatch(frame)
+				if self.pending:
+					self.expire()
+		except (OSError, AttributeError) as e: #AttributeError - socket closed under us
+			error = ConnectionError(str(e))
+		with self._lock:
+			self.reading = False
+			pending = self.pending
+			self.pending = {}
+		for future, convert, deadline in pending.values():
+			future.set_exception(error)
+
+	def _dispatch(self, frame):
+		with self._lock:
+			entry = self.pending.pop(frame.get("id"), None)
+		if entry is None:
+			self.message(frame)
+			return
+		future, convert, deadline = entry
+		try:
+			future.set_result(convert(frame) if convert is not None else frame)
+		except Exception as e:
+			future.set_exception(e)
+
+#Connection pool class
+class YeeConnectionPool:
+	"""
+	Small bounded pool of long-lived connections to one bulb.
+	The bulb accepts only a few simultaneous connections, so keep 'size' low.
+	Args:
+		size: maximum number of open connections
+		idle_timeout: connections idle for longer than this (s) are closed and reopened on next use
+		timeout: socket timeout passed to YeeConnection (None - blocking)
+		on_message: callback for frames that are not replies (props notifications)
+	"""
+	__slots__ = ("ip", "port", "size", "idle_timeout", "timeout", "on_message", "_idle", "_count", "_cond", "_closed")
+	def __init__(self, ip, port, size = 1, idle_timeout = 300, timeout = None, on_message = None):
+		self.ip = ip
+		self.port = port
+		self.size = size
+		self.idle_timeout = idle_timeout
+		self.timeout = timeout
+		self.on_message = on_message
+		self._idle = [] #Stack of idle connections, most recently used last
+		self._count = 0 #Connections handed out or idle
+		self._cond = threading.Condition()
+		self._closed = False
+
+	def acquire(self, timeout = None):
+		"""
+		Returns a connected YeeConnection for exclusive use.
+		Reuses an idle one when it is still alive, otherwise opens a new one.
+		Blocks while all 'size' connections are in use.
+		'timeout' (s) limits both the wait for a free connection and the TCP handshake.
+		"""
+		with self._cond:
+			while True:
+				if self._closed:
+					raise ConnectionError("Connection pool is closed")
+				if self._idle:
+					conn = self._idle.pop()
+					break
+				if self._count < self.size:
+					self._count += 1
+					conn = None
+					break
+				if not self._cond.wait(timeout):
+					raise TimeoutError("No free connection to " + str(self.ip))
+		try:
+			if conn is None:
+				conn = YeeConnection(self.ip, self.port, self.timeout, self.on_message)
+				conn.connect(timeout)
+			elif not self._usable(conn):
+				conn.connect(timeout)
+		except Exception:
+			self._discard(conn)
+			raise
+		return conn
+
+	def release(self, conn, broken = False):
+		"""Gives a connection back. Broken connections are closed and their slot freed."""
+		with self._cond:
+			if broken or self._closed or conn.sock is None:
+				conn.close()
+				self._count -= 1
+			else:
+				self._idle.append(conn)
+			self._cond.notify()
+
+	@property
+	def closed(self):
+		return self._closed
+
+	def reconnect(self, conn, timeout = None):
+		"""Reopens a connection that failed while in use, keeping its pool slot"""
+		conn.connect(timeout)
+		return conn
+
+	def poll(self):
+		"""Handles data waiting on idle connections (props notifications) without blocking"""
+		with self._cond:
+			keep = []
+			for conn in self._idle:
+				try:
+					conn.drain()
+					keep.append(conn)
+				except OSError:
+					conn.close()
+					self._count -= 1
+			self._idle = keep
+
+	def prune(self):
+		"""Closes connections that have been idle for longer than 'idle_timeout'"""
+		now = time.monotonic()
+		with self._cond:
+			keep = []
+			for conn in self._idle:
+				if self.idle_timeout is not None and now - conn.last_used > self.idle_timeout:
+					conn.close()
+					self._count -= 1
+				else:
+					keep.append(conn)
+			self._idle = keep
+			self._cond.notify_all()
+
+	def close(self):
+		"""Closes all idle connections. Connections in use are closed when released."""
+		with self._cond:
+			self._closed = True
+			for conn in self._idle:
+				conn.close()
+				self._count -= 1
+			self._idle = []
+			self._cond.notify_all()
+
+	def _usable(self, conn):
+		if self.idle_timeout is not None and time.monotonic() - conn.last_used > self.idle_timeout:
+			return False
+		return conn.alive()
+
+	def _discard(self, conn):
+		if conn is not None:
+			conn.close()
+		with self._cond:
+			self._count -= 1
+			self._cond.notify()
@@ -0,0 +1,153 @@
+import re	#Regex library
+import random
+import YeeMetrics
+
+#----------Variables----------
+MCAST_GRP = '239.255.255.250' #Multicast group
+MCAST_PORT = 1982 #Multicast port
+ADVERTISED_PROPS = ["power", "bright", "color_mode", "ct", "rgb", "hue", "sat"] #Properties included in search responses
+DEFAULT_MAX_AGE = 3600 #Validity (s) of an advertisement without Cache-Control
+LOCATION_RE = re.compile(r"yeelight://([0-9]{1,3}(?:\.[0-9]{1,3}){3}):([0-9]+)")
+MAX_AGE_RE = re.compile(r"max-age\s*=\s*([0-9]+)")
+
+#Search schedule class
+class SearchSchedule:
+	"""
+	Timing of the search broadcasts.
+	Starts with 'initial' seconds between searches and multiplies the interval by 'backoff' after
+	every search that found no new bulb, up to 'maximum'. A new bulb resets it to 'initial'.
+	Every delay gets a random +-'jitter' fraction so several controllers don't broadcast in sync.
+	"""
+	def __init__(self, initial = 2.0, maximum = 30.0, backoff = 2.0, jitter = 0.1):
+		self.initial = initial
+		self.maximum = maximum
+		self.backoff = backoff
+		self.jitter = jitter
+		self.interval = initial
+
+	def next_delay(self, found_new = False):
+		"""Returns the time (s) until the next search, 'found_new' - the last search found new bulbs"""
+		if found_new:
+			self.interval = self.initial
+		delay = self.interval
+		self.interval = min(self.maximum, self.interval * self.backoff)
+		return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+	def reset(self):
+		self.interval = self.initial
+
+#----------Functions----------
+def search_message():
+	"""Builds the SSDP search request sent to MCAST_GRP:MCAST_PORT"""
+	msg = "M-SEARCH * HTTP/1.1\r\n"
+	msg = msg + "HOST: 239.255.255.250:1982\r\n"
+	msg = msg + "MAN: \"ssdp:discover\"\r\n"
+	msg = msg + "ST: wifi_bulb"
+	return msg
+
+def parse_headers(data):
+	"""
+	Splits an SSDP message into a dict of headers in one pass.
+	Header names are lower case, values stripped. The start line is skipped.
+	"""
+	headers = {}
+	for line in data.split("\n")[1:]:
+		key, sep, value = line.partition(":")
+		if sep:
+			headers[key.strip().lower()] = value.strip()
+	return headers
+
+def parse_search_response(data):
+	"""
+	Parses a search response or advertisement.
+	Returns a dict with ip, port, id (hardware id), model, name, support (list of methods),
+	props ({prop: value} of the advertised state) and max_age (s), or None for invalid data.
+	"""
+	headers = parse_headers(data)
+	#Grabs (Ex): Location: yeelight://192.168.1.239:55443
+	match = LOCATION_RE.match(headers.get("location", ""))
+	if match == None:
+		return None
+	props = {}
+	for prop in ADVERTISED_PROPS:
+		value = headers.get(prop)
+		if value:
+			props[prop] = value
+	max_age = MAX_AGE_RE.search(headers.get("cache-control", ""))
+	return {
+		"ip": match.group(1),
+		"port": match.group(2),
+		"id": headers.get("id", match.group(1)), #Fall back to the ip for bulbs without an id
+		"model": headers.get("model", ""),
+		"name": headers.get("name", ""),
+		"support": headers.get("support", "").split(),
+		"props": props,
+		"max_age": int(max_age.group(1)) if max_age else DEFAULT_MAX_AGE,
+	}
+
+#Response cache class
+class ResponseCache:
+	"""
+	Deduplicates advertisements.
+	Bulbs re-announce themselves and answer every search, mostly with the very same text.
+	A text seen before from the same bulb "id" is not parsed again until its max-age runs out.
+	A new text is parsed and counts as a duplicate if it carries the same content, e.g. the
+	NOTIFY advertisement and the search reply of an unchanged bulb; it is remembered too, so
+	alternating between them stays on the fast path. Holds one response and up to
+	MAX_TEXTS texts per bulb.
+	"""
+	MAX_TEXTS = 4 #Texts remembered per bulb (start line and header variants of one advertisement)
+
+	def __init__(self):
+		self.by_data = {} #{raw data: (response, expires)}
+		self.by_id = {} #{hardware id: (response, [raw data, ...])}
+
+	def parse(self, data, now):
+		"""
+		Returns (response, changed). 'changed' is False for a duplicate of a still valid
+		advertisement. response is None for invalid data.
+		"""
+		metrics = YeeMetrics.collector
+		if metrics is not None:
+			metrics.discovery("datagram")
+		entry = self.by_data.get(data)
+		if entry is not None and entry[1] > now:
+			if metrics is not None:
+				metrics.discovery("duplicate")
+			return (entry[0], False)
+		response = parse_search_response(data)
+		if response == None:
+			if metrics is not None:
+				metrics.discovery("invalid")
+			return (None, False)
+		if metrics is not None:
+			metrics.discovery("parsed")
+		expires = now + response["max_age"]
+		known = self.by_id.get(response["id"])
+		if known is not None and known[0] == response:
+			#Same content in another text: remember the text, keep the known response
+			texts = known[1]
+			if data not in texts:
+				texts.append(data)
+				if len(texts) > ResponseCache.MAX_TEXTS:
+					self.by_data.pop(texts.pop(0), None)
+			for text in texts:
+				self.by_data[text] = (known[0], expires)
+			if metrics is not None:
+				metrics.discovery("duplicate")
+			return (known[0], False)
+		self.forget(response["id"])
+		self.by_id[response["id"]] = (response, [data])
+		self.by_data[data] = (response, expires)
+		return (response, True)
+
+	def forget(self, bulb_id):
+		"""Drops the cached advertisement of a bulb"""
+		known = self.by_id.pop(bulb_id, None)
+		if known is not None:
+			for text in known[1]:
+				self.by_data.pop(text, None)
+
+	def clear(self):
+		self.by_data.clear()
+		self.by_id.clear()
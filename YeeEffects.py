@@ -0,0 +1,144 @@
+import threading
+import time
+from YeeProtocol import quoted
+
+#Effect engine class
+class EffectEngine:
+	"""
+	Host-side effects streamed to a set of bulbs over music mode.
+	Every tick the render function is called as render(frame, t) with the frame number and the
+	time since start() (s), and returns {bulb.id: state}. A state is a dict with any of
+		"power": True|False, "rgb": 0..16777215, "hsv": (hue, sat), "ct": 1700..6500, "bright": 1..100
+	Bulbs and keys missing from a frame keep their last value. Each frame is diffed against what was
+	last sent, so only changed values generate traffic.
+	Commands go through the YeeBulb setters with the bulb's coalescing queue on: a bulb that cannot
+	keep up (no music mode, so the quota applies, or a slow link) has its stale frames replaced by
+	newer ones instead of building a backlog, and the replaced commands are counted as dropped.
+	Power changes are queued without waiting for them, so a bulb held up by its quota never stalls the render thread.
+	Args:
+		bulbs: YeeBulb instances (thread based, not AsyncYeeBulb)
+		render: the per-frame function
+		rate: ticks per second
+		music: switch the bulbs to music mode on start() and back on stop()
+		effect, duration: transition passed to the setters, e.g. "smooth" over one tick
+	"""
+	def __init__(self, bulbs, render, rate = 30, music = True, effect = "sudden", duration = 30):
+		self.bulbs = list(bulbs)
+		self.render = render
+		self.interval = 1.0 / rate
+		self.music = music
+		self.effect = effect
+		self.duration = max(30, int(duration))
+		self.frame = 0
+		self.late = 0 #Ticks skipped because a frame took longer than the interval
+		self.sent = {} #{bulb.id: commands sent}
+		self.last_sent = {} #{bulb.id: {key: value}}
+		self.coalesced_start = {} #{bulb.id: queue.coalesced at start()}
+		self.coalesce_before = {} #{bulb.id: coalesce flag to restore}
+		self.music_started = [] #Bulbs we switched to music mode
+		self.started = None
+		self.thread = None
+		self.running = False
+
+	def start(self):
+		"""Prepares the bulbs and starts rendering in a background thread"""
+		if self.thread is not None:
+			return
+		self.prepare()
+		self.running = True
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		"""Stops rendering, restores the bulbs' coalescing and leaves music mode"""
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		for bulb in self.bulbs:
+			bulb.coalesce = self.coalesce_before.pop(bulb.id, bulb.coalesce)
+		for bulb in self.music_started:
+			bulb.set_music(0)
+		self.music_started = []
+
+	def prepare(self):
+		"""Turns on coalescing and music mode, done by start() - call it before step() when driving ticks by hand"""
+		self.started = time.monotonic()
+		for bulb in self.bulbs:
+			self.coalesce_before[bulb.id] = bulb.coalesce
+			bulb.coalesce = True
+			self.coalesced_start[bulb.id] = bulb.queue.coalesced
+			if self.music and bulb.music is None:
+				result = bulb.set_music(1)
+				if result[0]:
+					self.music_started.append(bulb)
+
+	def run(self):
+		next_tick = time.monotonic()
+		while self.running:
+			self.step(next_tick - self.started)
+			next_tick += self.interval
+			now = time.monotonic()
+			if now > next_tick:
+				#Fell behind, skip the missed ticks instead of rendering them late
+				missed = int((now - next_tick) / self.interval) + 1
+				self.late += missed
+				next_tick += missed * self.interval
+			time.sleep(max(0, next_tick - time.monotonic()))
+
+	def step(self, t):
+		"""Renders one frame and sends what changed"""
+		states = self.render(self.frame, t) or {}
+		self.frame += 1
+		for bulb in self.bulbs:
+			state = states.get(bulb.id)
+			if state:
+				self.send(bulb, state)
+
+	def send(self, bulb, state):
+		last = self.last_sent.setdefault(bulb.id, {})
+		changed = {key: value for key, value in state.items() if last.get(key) != value}
+		if not changed:
+			return
+		commands = 0
+		if changed.get("power") is True:
+			self.set_power(bulb, "on")
+			commands += 1
+		if "rgb" in changed:
+			bulb.set_rgb(changed["rgb"], self.effect, self.duration)
+			commands += 1
+		elif "hsv" in changed:
+			bulb.set_hue(changed["hsv"][0], changed["hsv"][1], self.effect, self.duration)
+			commands += 1
+		elif "ct" in changed:
+			bulb.set_ct(changed["ct"], self.effect, self.duration)
+			commands += 1
+		if "bright" in changed:
+			bulb.set_bright(changed["bright"], self.effect, self.duration)
+			commands += 1
+		if changed.get("power") is False:
+			self.set_power(bulb, "off")
+			commands += 1
+		last.update(changed)
+		self.sent[bulb.id] = self.sent.get(bulb.id, 0) + commands
+
+	@staticmethod
+	def set_power(bulb, power):
+		"""Queues set_power without waiting for it (turn_on()/turn_off() block on ordering barriers)"""
+		bulb.submit("set_power", (quoted(power), quoted("sudden"), 30))
+
+	def dropped(self, bulb):
+		"""Commands replaced by newer frames before they were sent, i.e. frames the bulb fell behind on"""
+		return bulb.queue.coalesced - self.coalesced_start.get(bulb.id, bulb.queue.coalesced)
+
+	def stats(self):
+		"""Returns frame counts and per bulb {sent, dropped, music} accounting"""
+		return {
+			"frames": self.frame,
+			"late": self.late,
+			"bulbs": {bulb.id: {
+				"sent": self.sent.get(bulb.id, 0),
+				"dropped": self.dropped(bulb),
+				"music": bulb.music is not None,
+			} for bulb in self.bulbs},
+		}
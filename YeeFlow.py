@@ -0,0 +1,140 @@
+from collections import namedtuple
+
+#----------Variables----------
+#Flow step modes
+MODE_COLOR = 1
+MODE_CT = 2
+MODE_SLEEP = 7
+#What the bulb does when the flow ends
+ACTION_RECOVER = 0 #Back to the state before the flow
+ACTION_STAY = 1 #Keep the last state of the flow
+ACTION_OFF = 2 #Turn off
+MIN_DURATION = 50 #ms
+CT_RANGE = (1700, 6500)
+RGB_MAX = 0xFFFFFF
+KEEP_BRIGHT = -1 #Brightness value that leaves the brightness as it is
+
+#One state change of a flow, the [duration, mode, value, brightness] tuple of start_cf
+FlowStep = namedtuple("FlowStep", ["duration", "mode", "value", "bright"])
+
+def check_step(duration, mode, value, bright):
+	"""Validates one flow tuple against the spec limits, returns it as a FlowStep or raises ValueError"""
+	duration = int(duration)
+	mode = int(mode)
+	if duration < MIN_DURATION:
+		raise ValueError("Flow duration must be at least " + str(MIN_DURATION) + " ms")
+	if mode == MODE_SLEEP:
+		return FlowStep(duration, MODE_SLEEP, 0, 0) #Value and brightness are ignored
+	value = int(value)
+	bright = int(bright)
+	if mode == MODE_COLOR:
+		if not 0 <= value <= RGB_MAX:
+			raise ValueError("Flow rgb value out of range")
+	elif mode == MODE_CT:
+		if not CT_RANGE[0] <= value <= CT_RANGE[1]:
+			raise ValueError("Flow ct value out of range")
+	else:
+		raise ValueError("Unknown flow mode " + str(mode))
+	if bright != KEEP_BRIGHT and not 1 <= bright <= 100:
+		raise ValueError("Flow brightness out of range")
+	return FlowStep(duration, mode, value, bright)
+
+def merge_steps(steps):
+	"""
+	Drops redundant steps without changing what the bulb shows:
+	a transition to the state the bulb is already in becomes a sleep,
+	and adjacent sleeps are joined into one.
+	"""
+	merged = []
+	current = None #(mode, value, bright) reached by the last transition
+	for step in steps:
+		if step.mode != MODE_SLEEP:
+			target = (step.mode, step.value, step.bright)
+			if target != current:
+				current = target
+				merged.append(step)
+				continue
+			step = FlowStep(step.duration, MODE_SLEEP, 0, 0)
+		if merged and merged[-1].mode == MODE_SLEEP:
+			merged[-1] = FlowStep(merged[-1].duration + step.duration, MODE_SLEEP, 0, 0)
+		else:
+			merged.append(step)
+	return merged
+
+def flow_params(count, action, steps):
+	"""Encodes start_cf params: count,action,"duration,mode,value,bright,..." """
+	expression = ",".join(",".join(str(field) for field in step) for step in steps)
+	return str(int(count)) + "," + str(int(action)) + ",\"" + expression + "\""
+
+#Flow class
+class Flow:
+	"""
+	Declarative color flow for start_cf.
+	Steps are added with color(), ct() and sleep() (each returns the flow, so calls chain),
+	are validated as they are added and compiled once to the start_cf params string;
+	the compiled form is cached, so one Flow can be started on any number of bulbs.
+	The whole flow runs on the bulb, a long generated flow costs a single command.
+		sunrise = Flow(repeat = 1, action = ACTION_STAY).ct(1700, 1000, 1).ct(2700, 60000, 50).ct(4000, 60000, 100)
+		bulb.start_flow(sunrise)
+	Args:
+		repeat: how many times the steps are played, 0 - forever
+		action: ACTION_RECOVER, ACTION_STAY or ACTION_OFF after the flow ends
+		merge: join redundant adjacent steps when compiling
+	"""
+	def __init__(self, repeat = 1, action = ACTION_RECOVER, merge = True):
+		if int(repeat) < 0:
+			raise ValueError("Flow repeat must be >= 0")
+		if int(action) not in (ACTION_RECOVER, ACTION_STAY, ACTION_OFF):
+			raise ValueError("Unknown flow action " + str(action))
+		self.repeat = int(repeat)
+		self.action = int(action)
+		self.merge = merge
+		self.steps = []
+		self._compiled = None
+
+	def __len__(self):
+		return len(self.steps)
+
+	def add(self, duration, mode, value = 0, bright = KEEP_BRIGHT):
+		"""Appends a raw [duration, mode, value, brightness] step"""
+		self.steps.append(check_step(duration, mode, value, bright))
+		self._compiled = None
+		return self
+
+	def color(self, rgb_value, duration, bright = KEEP_BRIGHT):
+		"""Changes to 'rgb_value' over 'duration' ms"""
+		return self.add(duration, MODE_COLOR, rgb_value, bright)
+
+	def rgb(self, red, green, blue, duration, bright = KEEP_BRIGHT):
+		return self.color((int(red) << 16) | (int(green) << 8) | int(blue), duration, bright)
+
+	def ct(self, ct_value, duration, bright = KEEP_BRIGHT):
+		"""Changes to color temperature 'ct_value' over 'duration' ms"""
+		return self.add(duration, MODE_CT, ct_value, bright)
+
+	def sleep(self, duration):
+		"""Holds the current state for 'duration' ms"""
+		return self.add(duration, MODE_SLEEP)
+
+	def extend(self, steps):
+		"""Appends (duration, mode, value, bright) tuples, e.g. a generated curve"""
+		for step in steps:
+			self.add(*step)
+		return self
+
+	def compiled_steps(self):
+		return merge_steps(self.steps) if self.merge else list(self.steps)
+
+	def compile(self):
+		"""Returns the start_cf params string, compiled on first use"""
+		if self._compiled is None:
+			if not self.steps:
+				raise ValueError("Flow has no steps")
+			steps = self.compiled_steps()
+			#count is the number of state changes, so it follows the compiled step count
+			self._compiled = flow_params(self.repeat * len(steps), self.action, steps)
+		return self._compiled
+
+	def duration(self):
+		"""Length of one pass in ms"""
+		return sum(step.duration for step in self.steps)
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+#Bulb group class
+class BulbGroup:
+	"""
+	A set of bulbs addressed as one.
+	Any YeeBulb method can be called on the group and is fanned out to all members concurrently:
+		ok, results = group.set_rgb(255, timeout = 0.5)
+	'ok' is True only if every bulb succeeded, 'results' maps bulb id -> the bulb's result tuple.
+	Bulbs that miss the group timeout get (False, "Timed out"), the others keep their results.
+	"""
+	MAX_WORKERS = 64 #Threads shared by all groups
+	executor = None
+	_executor_lock = threading.Lock()
+
+	def __init__(self, name, bulbs = ()):
+		self.name = name
+		self.bulbs = list(bulbs)
+
+	def __len__(self):
+		return len(self.bulbs)
+
+	def __iter__(self):
+		return iter(self.bulbs)
+
+	def __getattr__(self, method):
+		if method.startswith("_"):
+			raise AttributeError(method)
+		def group_method(*args, timeout = None, **kwargs):
+			return self.call(method, *args, timeout = timeout, **kwargs)
+		return group_method
+
+	def add(self, bulb):
+		if bulb not in self.bulbs:
+			self.bulbs.append(bulb)
+
+	def remove(self, bulb):
+		if bulb in self.bulbs:
+			self.bulbs.remove(bulb)
+
+	@classmethod
+	def get_executor(cls):
+		with cls._executor_lock:
+			if cls.executor is None:
+				cls.executor = ThreadPoolExecutor(max_workers = cls.MAX_WORKERS, thread_name_prefix = "BulbGroup")
+			return cls.executor
+
+	def call(self, method, *args, timeout = None, **kwargs):
+		"""
+		Runs bulb.<method>(*args, **kwargs) on all members concurrently.
+		'timeout' (s) applies to the group as a whole.
+		Returns (all_succeeded, {bulb_id: result tuple}).
+		"""
+		return self.fan_out([(bulb, args) for bulb in self.bulbs], method, kwargs, timeout)
+
+	def map(self, method, values, *args, timeout = None, **kwargs):
+		"""
+		call() with a different first argument per member: member i gets values[i], e.g.
+			group.map("set_rgb", YeeColor.hsv_to_wire(hues, 100))
+		NumPy arrays are converted to Python ints in one go.
+		"""
+		if hasattr(values, "tolist"):
+			values = values.tolist()
+		if len(values) != len(self.bulbs):
+			raise ValueError("Expected " + str(len(self.bulbs)) + " values, got " + str(len(values)))
+		return self.fan_out([(bulb, (value,) + args) for bulb, value in zip(self.bulbs, values)], method, kwargs, timeout)
+
+	def fan_out(self, jobs, method, kwargs, timeout):
+		"""Runs bulb.<method>(*args, **kwargs) for each (bulb, args) in 'jobs' on the shared executor"""
+		executor = BulbGroup.get_executor()
+		futures = {}
+		for bulb, args in jobs:
+			futures[executor.submit(BulbGroup.run, bulb, method, args, kwargs)] = bulb
+		finished, _ = wait(futures, timeout)
+		results = {}
+		for future, bulb in futures.items():
+			if future in finished:
+				results[bulb.id] = future.result()
+			else:
+				results[bulb.id] = (False, "Timed out")
+		return (BulbGroup.succeeded(results), results)
+
+	async def acall(self, method, *args, timeout = None, **kwargs):
+		"""call() for AsyncYeeBulb members, fans out on the running event loop"""
+		tasks = {}
+		for bulb in self.bulbs:
+			tasks[asyncio.ensure_future(BulbGroup.arun(bulb, method, args, kwargs))] = bulb
+		if tasks:
+			await asyncio.wait(tasks, timeout = timeout)
+		results = {}
+		for task, bulb in tasks.items():
+			if task.done():
+				results[bulb.id] = task.result()
+			else:
+				task.cancel()
+				results[bulb.id] = (False, "Timed out")
+		return (BulbGroup.succeeded(results), results)
+
+	@staticmethod
+	def run(bulb, method, args, kwargs):
+		try:
+			result = getattr(bulb, method)(*args, **kwargs)
+		except Exception as e:
+			return (False, e)
+		return BulbGroup.as_result(result)
+
+	@staticmethod
+	async def arun(bulb, method, args, kwargs):
+		try:
+			result = getattr(bulb, method)(*args, **kwargs)
+			if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+				result = await result
+		except Exception as e:
+			return (False, e)
+		return BulbGroup.as_result(result)
+
+	@staticmethod
+	def as_result(result):
+		"""Methods that return nothing (e.g. set_music on older bulbs) count as success"""
+		if isinstance(result, tuple) and len(result) == 2:
+			return result
+		return (True, result)
+
+	@staticmethod
+	def succeeded(results):
+		for result in results.values():
+			if not result[0]:
+				return False
+		return True
+
+	@staticmethod
+	def failures(results):
+		"""Returns {bulb_id: result} of the bulbs that failed or timed out"""
+		return {bulb_id: result for bulb_id, result in results.items() if not result[0]}
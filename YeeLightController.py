@@ -1,351 +1,438 @@
 import sys	#For sys.exit()
-import re	#Regex library
+import json	#Machine-readable list output
 import socket	#Library for sockets
-import errno	#Error indication
+import selectors	#Waits for socket events (epoll/kqueue/select)
 import struct	#Performs conversions between Python values and bytes objects
 import threading	#Multithreding library
 from YeeBulb import YeeBulb
-from time import sleep
+from YeeGroup import BulbGroup
+from YeeRegistry import BulbRegistry
+from YeeDiscovery import MCAST_GRP, MCAST_PORT, ResponseCache, SearchSchedule, search_message
+from time import sleep, monotonic
 
-#----------Variables----------
-##Dictionary of discovered bulbs. {bulb_ip:YeeBulb)
-detected_bulbs = {} #Dictionary of detected light bulbs ip->bulb map
-bulb_id2ip = {} #{bulb_index:bulb_ip}
-supported_properties = ["power", "bright", "ct", "rgb", "hue", "sat", "color_mode", "flowing", "delayoff", "flow_params", "music_on", "name"]
-DEBUGGING = False	#Turn on/off debugging messages
-RUNNING = True	#Stops bulb detection loop
-MCAST_GRP = '239.255.255.250' #Multicast group
-MCAST_PORT = 1982 #Multicast port
+#Controller class
+class YeeLightController:
+	"""
+	Bulb manager: discovery, the bulb registry, groups and the command line interface.
+	Creating a controller does not touch the network, start() opens the discovery sockets
+	and stop() closes everything again.
+	Args:
+		search_address: where search requests are sent (multicast group and port)
+		listen_port: UDP port for bulb advertisements
+	"""
+	GROUP_TIMEOUT = 2.0 #Time limit (s) for a command sent to a group of bulbs
+	LIST_TIMEOUT = 1.0 #Time limit (s) for querying all bulbs in the list command
+	EXPIRE_INTERVAL = 1.0 #How often (s) the detection loop drops bulbs that went silent and prunes idle connections
+	DEBUGGING = False	#Turn on/off debugging messages
 
-#----------Sockets----------
-#Creating socket	
-scan_socket= socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-#SOCK_DGRAM <- allows UDP connection (SOCK.STREAM for TCP)
-listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)#udp
-#listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)#allows multiple instances
-listen_socket.bind(("", 1982))#sock.bind((UDP_IP, UDP_PORT))
-mreq = struct.pack("=4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
-listen_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-listen_socket.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_LOOP, 0)#To stop looping back the send requests
+	def __init__(self, search_address = (MCAST_GRP, MCAST_PORT), listen_port = MCAST_PORT):
+		self.search_address = search_address
+		self.listen_port = listen_port
+		self.registry = BulbRegistry() #Detected light bulbs by hardware id, ip, name and index
+		self.groups = {} #{group_name:[bulb_index, ...]}
+		self.search_schedule = SearchSchedule() #Search broadcast timing, with backoff and jitter
+		self.search_requested = threading.Event()
+		self.response_cache = ResponseCache() #Skips re-parsing unchanged advertisements
+		self.running = False	#Stops bulb detection loop
+		self.detection_thread = None
+		self.scan_socket = None
+		self.listen_socket = None
+		self.wakeup_recv = None
+		self.wakeup_send = None
 
-#----------Functions----------
-def debug(msg):
-	if DEBUGGING:
-		print(msg)
+	def debug(self, msg):
+		if self.DEBUGGING:
+			print(msg)
 
-def print_cli_usage():
-	"""Prints viable user commands"""
-	print("Usage:")
-	print("  q|quit: quit bulb manager")
-	print("  h|help: print this message")
-	print("  on: Turn the bulb on")
-	print("  off: Turn the bulb off")
-	print("  t|toggle <idx>: toggle bulb indicated by idx")
-	print("  b|bright <idx> <bright>: set brightness of bulb with label <idx>")
-	print("  r|refresh: refresh bulb list")
-	print("  l|list: list all managed bulbs")
-	print("  ct|ColorTemp <idx> <temperature> <effect> <duration>: set color temperature (1700K <= ct_value <= 6500K")
-	print("  rgb <idx> <rgb value> <effect> <duration>: set rgb value (0 <= rgb_value <= 16777215)")
-	print("  hue <idx> <hue> <sat> <effect> <duration>: set color hue (0 <= hue <= 359,  0 <= sat <= 100)")
-	print("  p|param <idx> <param_1> <param_2> ... <param_n>: get current bulb parameter state")
-	print("  s|SetDef: Sets current bulb state as default.")
-	print("  a|adjust: <idx> <property> <action> This method is used to change brightness, CT or color of a smart LED")
-def get_param_value(data, param):
-	"""
-	Match line of 'param = value'
-	"""
-	param_re = re.compile(param + ":\s*([ -~]*)") #match all printable characters
-	match = param_re.search(data)
-	value=""
-	if match != None:
-		value = match.group(1)
-		return value
+	def print_cli_usage(self):
+		"""Prints viable user commands"""
+		print("Usage:")
+		print("  q|quit: quit bulb manager")
+		print("  h|help: print this message")
+		print("  <idx> can also be a bulb name, a group name or 'all'")
+		print("  on <idx>: Turn the bulb on")
+		print("  off <idx>: Turn the bulb off")
+		print("  t|toggle <idx>: toggle bulb indicated by idx")
+		print("  b|bright <idx> <bright>: set brightness of bulb with label <idx>")
+		print("  r|refresh: refresh bulb list")
+		print("  l|list [json]: list all managed bulbs, 'json' prints one JSON object per bulb")
+		print("  g|group [<name> [<idx_1> ... <idx_n>]]: list groups, define group <name> or delete it when no idx is given")
+		print("  ct|ColorTemp <idx> <temperature> <effect> <duration>: set color temperature (1700K <= ct_value <= 6500K")
+		print("  rgb <idx> <rgb value> <effect> <duration>: set rgb value (0 <= rgb_value <= 16777215)")
+		print("  hue <idx> <hue> <sat> <effect> <duration>: set color hue (0 <= hue <= 359,  0 <= sat <= 100)")
+		print("  p|param <idx> <param_1> <param_2> ... <param_n>: get current bulb parameter state")
+		print("  s|SetDef <idx>: Sets current bulb state as default.")
+		print("  a|adjust: <idx> <property> <action> This method is used to change brightness, CT or color of a smart LED")
 
-def send_search_broadcast():
-	"""
-	Multicast search request to all hosts in LAN, do not wait for response
-	"""
-	multicase_address = (MCAST_GRP, MCAST_PORT) #Tuple with Multicast group and port
-	debug("\nSend search broadcast")
-	msg = "M-SEARCH * HTTP/1.1\r\n" 
-	msg = msg + "HOST: 239.255.255.250:1982\r\n"
-	msg = msg + "MAN: \"ssdp:discover\"\r\n"
-	msg = msg + "ST: wifi_bulb"
-	#Sends SSDP? search request to the socket
-	scan_socket.sendto(msg.encode(), multicase_address)#UDP
-	#.encode() to encode string into bytestring
-	sleep(1)
+	def send_search_broadcast(self):
+		"""
+		Multicast search request to all hosts in LAN, do not wait for response
+		"""
+		multicase_address = self.search_address #Tuple with Multicast group and port
+		self.debug("\nSend search broadcast")
+		msg = search_message()
+		#Sends SSDP? search request to the socket
+		self.scan_socket.sendto(msg.encode(), multicase_address)#UDP
+		#.encode() to encode string into bytestring
 
-def handle_search_response(data):
-	"""
-	Parse search response and extract all interested data.
-	If new bulb is found, insert it into dictionary of managed bulbs.
-	If bulb is already known - update it's info
-	"""
-	#Compile the pattern into regex object
-	location_re = re.compile("Location.*yeelight[^0-9]*([0-9]{1,3}(\.[0-9]{1,3}){3}):([0-9]*)")
-	#https://regex101.com/ <-explanation. Grabs (Ex): Location: yeelight://192.168.1.239:55443
-	# match() only attempts to match a pattern at the beginning of a string
-	match = location_re.search(data)
-	if match == None:
-		debug( "invalid data received: " + data )
-		return
+	def handle_search_response(self, data):
+		"""
+		Parse search response and extract all interested data.
+		If new bulb is found, insert it into dictionary of managed bulbs.
+		If bulb is already known - update it's info in place
+		Returns True for a new bulb.
+		"""
+		response, changed = self.response_cache.parse(data, monotonic())
+		if response == None:
+			self.debug( "invalid data received: " + data )
+			return False
+		if not changed and self.registry.touch(response["id"]):
+			return False #Same advertisement as before, nothing to update
 
-	bulb_ip = match.group(1)
-	#Check if bulb is already known
-	if bulb_ip in detected_bulbs:
-		#If known, grab an id
-		bulb_id = detected_bulbs[bulb_ip].id
-	else:
-		#If not give a new one
-		bulb_id = len(detected_bulbs)+1
+		#Add a new bulb or update the known one in place
+		bulb, added = self.registry.update(response, YeeBulb)
+		return added
 
-	bulb_port = match.group(3)
-	model = get_param_value(data, "model")
-	name = get_param_value(data, "name")
-	supported = get_param_value(data, "support") #Grab supported methods
-	#Create a new entry for the bulb
-	bulb_id2ip[int(bulb_id)] = bulb_ip
-	detected_bulbs[bulb_ip] = YeeBulb(bulb_id, bulb_ip, bulb_port, model, name, supported.split())
+	def bulbs_detection_loop(self):
+		"""
+		A standalone thread broadcasting search request and listening on all responses.
+		Blocks in the selector until a datagram arrives, the next search is due or
+		stop_detection()/request_search() wakes it up.
+		"""
+		self.scan_socket.setblocking(0)
+		self.listen_socket.setblocking(0)
+		self.debug("bulbs_detection_loop running") #msg if debuging
+		selector = selectors.DefaultSelector()
+		selector.register(self.scan_socket, selectors.EVENT_READ, "search_socket")
+		selector.register(self.listen_socket, selectors.EVENT_READ, "listener socket")
+		selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+		next_search = monotonic()
+		next_expire = next_search + self.EXPIRE_INTERVAL
+		found_new = False
+		failed = False
 
-def bulbs_detection_loop():
-	"""	A standalone thread broadcasting search request and listening on all responses.	"""
-	scan_socket.setblocking(0)
-	listen_socket.setblocking(0)
-	debug("bulbs_detection_loop running") #msg if debuging
-	search_interval=30000
-	read_interval=100
-	time_elapsed=0
+		while self.running and not failed:
+			now = monotonic()
+			#send search broadcast when the schedule says so
+			if now >= next_search:
+				self.send_search_broadcast()#Constructs and sends a search request to a socket scan_socket
+				next_search = now + self.search_schedule.next_delay(found_new)
+				found_new = False
+			if now >= next_expire:
+				for bulb in self.registry.expire(now):
+					self.debug("bulb expired: " + str(bulb.id))
+				for bulb in self.registry.values():
+					bulb.pool.prune() #Close connections idle for longer than the pool's idle_timeout
+				next_expire = now + self.EXPIRE_INTERVAL
 
-	while RUNNING:
-		#send search broadcast every "search_interval"
-		if time_elapsed%search_interval == 0:
-		  send_search_broadcast()#Constructs and sends a search request to a socket scan_socket
-		
-		# scanner
-		while True:
-			try:
-				DataBytes = scan_socket.recv(2048)#Receives data from the socket
-				#.recv() receives TCP message
-				data = DataBytes.decode()#Decode bytes->str
-			except socket.error as e:
-				err = e.args[0]
-				if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
-					break
-				else:
+			for key, events in selector.select(max(0, min(next_search, next_expire) - now)):
+				if key.data is None:
+					#Woken up by stop_detection() or request_search()
+					try:
+						self.wakeup_recv.recv(64)
+					except BlockingIOError:
+						pass
+					if self.search_requested.is_set():
+						self.search_requested.clear()
+						self.search_schedule.reset()
+						next_search = 0
+					continue
+				try:
+					DataBytes, addr = key.fileobj.recvfrom(2048)
+					data = DataBytes.decode()#Decode bytes->str
+				except BlockingIOError:
+					continue
+				except socket.error as e:
 					print(e)
-					sys.exit(1)
-			debug("search_socket:\n"+ data+"\n")
-			handle_search_response(data)
-		# passive listener 
-		while True:
-			try:
-				DataBytes, addr = listen_socket.recvfrom(2048)
-				#.recvfrom() receives UDP message
-				data = DataBytes.decode()
-			except socket.error as e:
-				err = e.args[0]
-				if err == errno.EAGAIN or err == errno.EWOULDBLOCK:
+					failed = True
 					break
-				else:
-					print (e)
-					sys.exit(1)
-			debug("listener socket:\n"+ data+"\n")
-			handle_search_response(data)
+				self.debug(key.data + ":\n"+ data+"\n")
+				if self.handle_search_response(data):
+					found_new = True
+		selector.close()
+		self.scan_socket.close()
+		self.listen_socket.close()
 
-		time_elapsed+=read_interval
-		sleep(read_interval/1000.0)
-		#debug(time_elapsed)
-	scan_socket.close()
-	listen_socket.close()
+	def start_detection(self):
+		"""
+		Opens the discovery sockets and starts the detection thread.
+		Nothing binds or joins the multicast group before this is called.
+		"""
+		if self.detection_thread is not None:
+			return
+		#Creating socket
+		self.scan_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		#SOCK_DGRAM <- allows UDP connection (SOCK.STREAM for TCP)
+		self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)#udp
+		#listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)#allows multiple instances
+		self.listen_socket.bind(("", self.listen_port))#sock.bind((UDP_IP, UDP_PORT))
+		mreq = struct.pack("=4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
+		self.listen_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+		self.listen_socket.setsockopt(socket.SOL_IP, socket.IP_MULTICAST_LOOP, 0)#To stop looping back the send requests
+		#Socket pair used to wake the detection loop up
+		self.wakeup_recv, self.wakeup_send = socket.socketpair()
+		self.wakeup_recv.setblocking(0)
+		self.running = True
+		#Creates a seperate thread that executes bulbs_detection_loop
+		self.detection_thread = threading.Thread(target=self.bulbs_detection_loop, daemon=True)
+		self.detection_thread.start()
 
-def display_bulbs():
-	"""	Displays info of the known bulbs. """	
-	#TODO this could try to access a dead bulb
-	print("Managed bulbs = "+str(len(detected_bulbs))+":")
-	for keys, values in detected_bulbs.items():
-		print(values.info())
-		
-def handle_user_input():
-	"""	User interaction loop. """
-	while True:
-		command_line = input("Enter a command: ")
-		valid_cli=True
-		debug("command_line=" + command_line)
-		command_line.lower() # convert all user input to lower case, i.e. cli is caseless
-		#create an array of word/parameters
-		argv = command_line.split() # i.e. don't allow parameters with space characters
-		if len(argv) == 0:
-			continue
-		if argv[0] == "q" or argv[0] == "quit":
-			print("Bye!")
+	def stop_detection(self):
+		""" Stops the detection loop without waiting for its next timeout and closes its sockets. """
+		if self.detection_thread is None:
 			return
-		elif argv[0] == "l" or argv[0] == "list":
-			display_bulbs()
-		elif argv[0] == "r" or argv[0] == "refresh":
-			detected_bulbs.clear()
-			bulb_id2ip.clear()
-			send_search_broadcast()
-			sleep(0.5)
-			display_bulbs()
-		elif argv[0] == "h" or argv[0] == "help":
-			print_cli_usage()
-			continue
-		elif argv[0] == "t" or argv[0] == "toggle":
-			if len(argv) != 2:
-				valid_cli=False
-			else:
-				try:
-					idx = int(float(argv[1]))
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].toggle()
-				except:
+		self.running = False
+		self.wakeup_send.send(b"\0")
+		self.detection_thread.join()
+		self.detection_thread = None
+		self.wakeup_send.close()
+		self.wakeup_recv.close()
+		self.wakeup_send = self.wakeup_recv = None
+		self.scan_socket = self.listen_socket = None
+
+	def start(self):
+		""" Starts bulb discovery, bulbs closed by stop() are reopened. """
+		for bulb in self.registry.values():
+			bulb.reopen()
+		self.start_detection()
+
+	def stop(self):
+		""" Stops discovery and closes the connections to all bulbs. """
+		self.stop_detection()
+		self.close_bulbs()
+
+	def request_search(self):
+		""" Makes the detection loop broadcast a search now and restart the backoff. """
+		self.search_requested.set()
+		if self.wakeup_send is not None:
+			self.wakeup_send.send(b"\0")
+
+	def get_group(self, target):
+		""" Resolves <idx>|<name>|<group name>|all into a BulbGroup. """
+		if target == "all":
+			return BulbGroup(target, self.registry.values())
+		if target in self.groups:
+			members = [self.registry.get_by_index(idx) for idx in self.groups[target]]
+			return BulbGroup(target, [bulb for bulb in members if bulb is not None])
+		bulb = self.registry.find(target)
+		if bulb is None:
+			raise KeyError("Unknown bulb " + target)
+		return BulbGroup(target, [bulb])
+
+	def run_command(self, target, method, *args):
+		""" Runs a YeeBulb method on all bulbs of <target> concurrently and prints the results. """
+		ok, results = self.get_group(target).call(method, *args, timeout = self.GROUP_TIMEOUT)
+		for bulb_id, result in results.items():
+			print(str(bulb_id) + ": " + str(result[1]))
+		return ok
+
+	def close_bulbs(self):
+		"""	Closes connections to all known bulbs. """
+		for bulb in self.registry.values():
+			bulb.close()
+
+	def display_bulbs(self, json_lines = False):
+		"""
+		Displays info of the known bulbs.
+		All bulbs are queried at once and LIST_TIMEOUT bounds the whole listing;
+		bulbs that miss it are shown with their last known state, marked stale.
+		json_lines - print one JSON object per bulb instead of the text listing
+		"""
+		bulbs = self.registry.values()
+		ok, results = BulbGroup("all", bulbs).call("get_state", YeeBulb.supported_properties, timeout = self.LIST_TIMEOUT)
+		if json_lines:
+			for bulb in bulbs:
+				print(json.dumps(bulb.describe(results[bulb.id])))
+			return
+		print("Managed bulbs = "+str(len(bulbs))+":")
+		for bulb in bulbs:
+			print(bulb.format_info(results[bulb.id]))
+
+	def handle_user_input(self):
+		"""	User interaction loop. """
+		while True:
+			command_line = input("Enter a command: ")
+			valid_cli=True
+			self.debug("command_line=" + command_line)
+			command_line.lower() # convert all user input to lower case, i.e. cli is caseless
+			#create an array of word/parameters
+			argv = command_line.split() # i.e. don't allow parameters with space characters
+			if len(argv) == 0:
+				continue
+			if argv[0] == "q" or argv[0] == "quit":
+				print("Bye!")
+				return
+			elif argv[0] == "l" or argv[0] == "list":
+				if len(argv) == 2 and argv[1] == "json":
+					self.display_bulbs(json_lines = True)
+				elif len(argv) == 1:
+					self.display_bulbs()
+				else:
 					valid_cli=False
-		elif argv[0] == "b" or argv[0] == "bright":
-			if not (3 <= len(argv) <= 5):
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					response = (detected_bulbs[ipb]).set_bright(*argv[2:])
-					print(response[1])
-				except Exception as e:
-					print(e)
+			elif argv[0] == "r" or argv[0] == "refresh":
+				self.registry.expire()
+				self.request_search()
+				sleep(0.5)
+				self.display_bulbs()
+			elif argv[0] == "g" or argv[0] == "group":
+				if len(argv) == 1:
+					for name, members in self.groups.items():
+						print(name + ": " + " ".join(str(idx) for idx in members))
+				elif argv[1] == "all":
+					print("'all' is reserved")
 					valid_cli=False
-		#MINE-------------------------------------------
-		elif argv[0] == "p" or argv[0] == "param":
-			if len(argv) < 3:
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					param_list = argv[2:] #Create a list of parameters
-					response = (detected_bulbs[ipb]).get_state(param_list)
-					state_list = response[1]
-					for i in range(0, len(state_list)):
-						print("\t" + param_list[i] + " = " + state_list[i])
-				except Exception as e:
-					print("Error: ", e)
+				elif len(argv) == 2:
+					self.groups.pop(argv[1], None)
+				else:
+					try:
+						self.groups[argv[1]] = [int(idx) for idx in argv[2:]]
+					except ValueError as e:
+						print(e)
+						valid_cli=False
+			elif argv[0] == "h" or argv[0] == "help":
+				self.print_cli_usage()
+				continue
+			elif argv[0] == "t" or argv[0] == "toggle":
+				if len(argv) != 2:
+					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "toggle")
+					except:
+						valid_cli=False
+			elif argv[0] == "b" or argv[0] == "bright":
+				if not (3 <= len(argv) <= 5):
+					print("incorrect argc")
 					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "set_bright", *argv[2:])
+					except Exception as e:
+						print(e)
+						valid_cli=False
+			#MINE-------------------------------------------
+			elif argv[0] == "p" or argv[0] == "param":
+				if len(argv) < 3:
+					print("incorrect argc")
+					valid_cli=False
+				else:
+					try:
+						param_list = argv[2:] #Create a list of parameters
+						ok, results = self.get_group(argv[1]).call("get_state", param_list, timeout = self.GROUP_TIMEOUT)
+						for bulb_id, response in results.items():
+							print(str(bulb_id) + ":")
+							state_list = response[1]
+							if not response[0]:
+								print("Error: ", state_list)
+								state_list = []
+							for i in range(0, len(state_list)):
+								print("\t" + param_list[i] + " = " + str(state_list[i]))
+					except Exception as e:
+						print("Error: ", e)
+						valid_cli=False
 
-		elif argv[0] == "ct" or argv[0] == "ColorTemp":
-			if not (3 <= len(argv) <= 5):
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					response = detected_bulbs[ipb].set_ct(*argv[2:])#Using *args to unpack a list and pass to function (Python black magic)
-					print(response[1])
-				except Exception as e:
-					print(e)
+			elif argv[0] == "ct" or argv[0] == "ColorTemp":
+				if not (3 <= len(argv) <= 5):
+					print("incorrect argc")
 					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "set_ct", *argv[2:])#Using *args to unpack a list and pass to function (Python black magic)
+					except Exception as e:
+						print(e)
+						valid_cli=False
 		
-		elif argv[0] == "rgb":
-			if not (3 <= len(argv) <= 5):
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].set_rgb(*argv[2:])
-				except Exception as e:
-					print(e)
+			elif argv[0] == "rgb":
+				if not (3 <= len(argv) <= 5):
+					print("incorrect argc")
 					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "set_rgb", *argv[2:])
+					except Exception as e:
+						print(e)
+						valid_cli=False
 
-		elif argv[0] == "hue":
-			if not (3 <= len(argv) <= 6):
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].set_hue(*argv[2:])
-				except Exception as e:
-					print(e)
+			elif argv[0] == "hue":
+				if not (3 <= len(argv) <= 6):
+					print("incorrect argc")
 					valid_cli=False
-		elif argv[0] == "on":
-			if len(argv) != 2:
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].turn_on()
-				except Exception as e:
-					print(e)
+				else:
+					try:
+						self.run_command(argv[1], "set_hue", *argv[2:])
+					except Exception as e:
+						print(e)
+						valid_cli=False
+			elif argv[0] == "on":
+				if len(argv) != 2:
+					print("incorrect argc")
 					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "turn_on")
+					except Exception as e:
+						print(e)
+						valid_cli=False
 		
-		elif argv[0] == "off":
-			if len(argv) != 2:
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].turn_off()
-				except Exception as e:
-					print(e)
-					valid_cli=False			
+			elif argv[0] == "off":
+				if len(argv) != 2:
+					print("incorrect argc")
+					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "turn_off")
+					except Exception as e:
+						print(e)
+						valid_cli=False			
 		
-	#---not tested
-		elif argv[0] == "set" or argv[0] == "SetDef":
-			if len(argv) != 2:
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].set_default()
-				except Exception as e:
-					print(e)
+		#---not tested
+			elif argv[0] == "set" or argv[0] == "SetDef":
+				if len(argv) != 2:
+					print("incorrect argc")
 					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "set_default")
+					except Exception as e:
+						print(e)
+						valid_cli=False
 
-		elif argv[0] == "a" or argv[0] == "adjust":
-			if len(argv) != 4:
-				print("incorrect argc")
-				valid_cli=False
-			else:
-				try:
-					idx = int(argv[1])
-					ipb = bulb_id2ip[idx]
-					detected_bulbs[ipb].set_adjust(*argv[2:])
-				except Exception as e:
-					print(e)
+			elif argv[0] == "a" or argv[0] == "adjust":
+				if len(argv) != 4:
+					print("incorrect argc")
 					valid_cli=False
+				else:
+					try:
+						self.run_command(argv[1], "set_adjust", *argv[2:])
+					except Exception as e:
+						print(e)
+						valid_cli=False
 		
-		#MINE-------------------------------------------END
-		else:
-			valid_cli=False
+			#MINE-------------------------------------------END
+			else:
+				valid_cli=False
 		
-		if not valid_cli:
-			print("error: invalid command line:", command_line)
-			print_cli_usage()
+			if not valid_cli:
+				print("error: invalid command line:", command_line)
+				self.print_cli_usage()
 
 #----------Main----------
-print("Welcome to Yeelight WifiBulb Lan controller")
-print_cli_usage()
+def main():
+	print("Welcome to Yeelight WifiBulb Lan controller")
+	controller = YeeLightController()
+	controller.print_cli_usage()
+	controller.start()
+	# give detection thread some time to collect bulb info
+	sleep(0.2)
+	# user interaction loop
+	try:
+		controller.handle_user_input()
+	except (EOFError, KeyboardInterrupt):
+		print("Bye!")
+	# user interaction end, tell detection thread to quit and wait
+	controller.stop()
+	return 0
 
-#Creates a seperate thread that executes bulbs_detection_loop 
-detection_thread = threading.Thread(target=bulbs_detection_loop)
-#Start the thread
-detection_thread.start()
-# give detection thread some time to collect bulb info
-sleep(0.2)
-# user interaction loop
-handle_user_input()
-# user interaction end, tell detection thread to quit and wait
-RUNNING = False
-detection_thread.join()
-sys.exit(0)
+if __name__ == "__main__":
+	sys.exit(main())
 #Done
\ No newline at end of file
@@ -0,0 +1,192 @@
+import time
+import logging
+import threading
+
+#----------Variables----------
+#The active Metrics, None - instrumentation is off.
+#Hooks read it once per command and skip all timing and counting when it is None.
+collector = None
+
+#----------Functions----------
+def enable(*sinks):
+	"""Turns instrumentation on, returns the Metrics that collects it. 'sinks' - see Metrics.add_sink()"""
+	global collector
+	collector = Metrics(sinks)
+	return collector
+
+def disable():
+	global collector
+	collector = None
+
+def log_sink(logger = None, level = logging.INFO):
+	"""Sink writing one log line per command or discovery event"""
+	if logger is None:
+		logger = logging.getLogger("yeelight")
+	def sink(kind, record):
+		if logger.isEnabledFor(level):
+			logger.log(level, kind + " " + " ".join(key + "=" + format_value(value) for key, value in record.items()))
+	return sink
+
+def format_value(value):
+	if isinstance(value, float):
+		return "%.6f" % value
+	return str(value)
+
+def escape_label(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(labels):
+	if not labels:
+		return ""
+	return "{" + ",".join(key + "=\"" + escape_label(value) + "\"" for key, value in labels) + "}"
+
+#Command trace class
+class CommandTrace:
+	"""
+	Timing of one command. Each mark(phase) adds the time since the previous mark to 'phase':
+		quota - waiting for the rate limiter
+		connect - getting a pooled connection, including the TCP handshake for a new one
+		send - draining idle notifications and writing the request
+		wait - until the reply frame arrived
+		parse - turning the reply into the result tuple
+	"""
+	def __init__(self, metrics, bulb, method):
+		self.metrics = metrics
+		self.bulb = str(bulb.id)
+		self.method = method
+		self.phases = {}
+		self.retries = 0
+		self.bytes_sent = 0
+		self.bytes_received = 0
+		self.start = self.last = time.perf_counter()
+
+	def mark(self, phase):
+		now = time.perf_counter()
+		self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+		self.last = now
+
+	def finish(self, result):
+		"""Records the command, returns 'result' unchanged"""
+		self.metrics.command(self, result)
+		return result
+
+	def finish_future(self, future):
+		"""Records the command when a submit() future resolves, returns the future"""
+		def done(future):
+			self.mark("wait")
+			error = future.exception()
+			self.finish((False, error) if error is not None else future.result())
+		future.add_done_callback(done)
+		return future
+
+#Metrics class
+class Metrics:
+	"""
+	Counters and phase timings of bulb commands and discovery.
+	Counters:
+		yeelight_commands_total{bulb, method}
+		yeelight_command_errors_total{bulb, method, code} - code is the bulb's error message
+			(e.g. "client quota exceeded") or the exception type
+		yeelight_command_retries_total{bulb, method}
+		yeelight_bytes_sent_total{bulb}, yeelight_bytes_received_total{bulb}
+		yeelight_discovery_events_total{event} - datagram, duplicate, invalid, parsed, added, updated, expired, removed
+	Timings: yeelight_command_phase_seconds{method, phase} (sum, count, max), see CommandTrace.
+	Sinks are called as sink(kind, record) for every command ("command") and discovery event ("discovery");
+	prometheus() renders the totals in the Prometheus text format.
+	"""
+	def __init__(self, sinks = ()):
+		self.sinks = list(sinks)
+		self.counters = {} #{(name, labels): value}, labels is a tuple of (key, value) pairs
+		self.timings = {} #{(method, phase): [count, sum, max]}
+		self._lock = threading.Lock()
+
+	def add_sink(self, sink):
+		self.sinks.append(sink)
+
+	def trace(self, bulb, method):
+		return CommandTrace(self, bulb, method)
+
+	def count(self, name, value = 1, labels = ()):
+		key = (name, labels)
+		with self._lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def command(self, trace, result):
+		"""Records a finished command"""
+		trace.phases["total"] = time.perf_counter() - trace.start
+		ok = result[0]
+		error = None
+		if not ok:
+			error = result[1] if isinstance(result[1], str) else type(result[1]).__name__
+		command = (("bulb", trace.bulb), ("method", trace.method))
+		with self._lock:
+			self.add("yeelight_commands_total", command, 1)
+			if error is not None:
+				self.add("yeelight_command_errors_total", command + (("code", error),), 1)
+			if trace.retries:
+				self.add("yeelight_command_retries_total", command, trace.retries)
+			self.add("yeelight_bytes_sent_total", (("bulb", trace.bulb),), trace.bytes_sent)
+			self.add("yeelight_bytes_received_total", (("bulb", trace.bulb),), trace.bytes_received)
+			for phase, seconds in trace.phases.items():
+				timing = self.timings.get((trace.method, phase))
+				if timing is None:
+					self.timings[(trace.method, phase)] = [1, seconds, seconds]
+				else:
+					timing[0] += 1
+					timing[1] += seconds
+					timing[2] = max(timing[2], seconds)
+		if self.sinks:
+			record = {"bulb": trace.bulb, "method": trace.method, "ok": ok, "error": error, "retries": trace.retries,
+				"bytes_sent": trace.bytes_sent, "bytes_received": trace.bytes_received}
+			record.update(trace.phases)
+			self.emit("command", record)
+
+	def add(self, name, labels, value):
+		"""Adds to a counter, the caller holds the lock"""
+		key = (name, labels)
+		self.counters[key] = self.counters.get(key, 0) + value
+
+	def discovery(self, event):
+		"""Counts a discovery event"""
+		self.count("yeelight_discovery_events_total", 1, (("event", event),))
+		if self.sinks:
+			self.emit("discovery", {"event": event})
+
+	def emit(self, kind, record):
+		for sink in list(self.sinks):
+			try:
+				sink(kind, record)
+			except Exception:
+				pass #A broken sink must not break the bulb
+
+	def snapshot(self):
+		"""Returns {"counters": [...], "timings": [...]}, JSON serialisable"""
+		with self._lock:
+			counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()]
+			timings = [{"method": method, "phase": phase, "count": timing[0], "sum": timing[1], "max": timing[2]}
+				for (method, phase), timing in self.timings.items()]
+		return {"counters": counters, "timings": timings}
+
+	def prometheus(self):
+		"""Renders all counters and timings in the Prometheus text exposition format"""
+		lines = []
+		with self._lock:
+			typed = set()
+			for (name, labels), value in sorted(self.counters.items()):
+				if name not in typed:
+					typed.add(name)
+					lines.append("# TYPE " + name + " counter")
+				lines.append(name + format_labels(labels) + " " + str(value))
+			if self.timings:
+				name = "yeelight_command_phase_seconds"
+				lines.append("# TYPE " + name + " summary")
+				for (method, phase), timing in sorted(self.timings.items()):
+					labels = format_labels((("method", method), ("phase", phase)))
+					lines.append(name + "_count" + labels + " " + str(timing[0]))
+					lines.append(name + "_sum" + labels + " " + repr(timing[1]))
+		return "\n".join(lines) + "\n"
+
+	def reset(self):
+		with self._lock:
+			self.counters.clear()
+			self.timings.clear()
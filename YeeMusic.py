@@ -0,0 +1,74 @@
+import socket
+
+#Music channel class
+class YeeMusicChannel:
+	"""
+	Music mode connection to one bulb.
+	Roles are reversed: we listen, send "set_music 1 host port" over the normal channel and the
+	bulb connects back. Commands sent over this socket get no reply and are not quota checked.
+	Args:
+		bulb_ip: used to pick the local address the bulb can reach when 'host' is None
+		host, port: address to listen on (port 0 - any free port)
+		timeout: how long to wait for the bulb to connect (s)
+	"""
+	def __init__(self, bulb_ip, host = None, port = 0, timeout = 5):
+		self.bulb_ip = bulb_ip
+		self.host = host if host else YeeMusicChannel.local_ip(bulb_ip)
+		self.port = int(port)
+		self.timeout = timeout
+		self.server = None
+		self.sock = None
+
+	@staticmethod
+	def local_ip(remote_ip):
+		"""Returns the address of the local interface used to reach 'remote_ip'"""
+		probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			probe.connect((remote_ip, 1)) #UDP connect sends nothing, it only picks a route
+			return probe.getsockname()[0]
+		finally:
+			probe.close()
+
+	def listen(self):
+		"""Starts the TCP listener, returns the (host, port) to announce to the bulb"""
+		self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.server.bind((self.host, self.port))
+		self.server.listen(1)
+		self.port = self.server.getsockname()[1]
+		return (self.host, self.port)
+
+	def accept(self):
+		"""Waits for the bulb to connect, the listener is closed afterwards"""
+		self.server.settimeout(self.timeout)
+		try:
+			sock, _ = self.server.accept()
+		finally:
+			self.server.close()
+			self.server = None
+		self.attach(sock)
+
+	def attach(self, sock):
+		"""Uses 'sock' (the bulb's inbound connection) as the music channel"""
+		sock.setblocking(True)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		sock.settimeout(self.timeout)
+		self.sock = sock
+
+	def active(self):
+		return self.sock is not None
+
+	def send(self, data):
+		"""Sends an encoded command, no reply is expected"""
+		self.sock.sendall(data)
+
+	def close(self):
+		"""Closes the channel, the bulb leaves music mode when the socket closes"""
+		for sock in (self.server, self.sock):
+			if sock is not None:
+				try:
+					sock.close()
+				except OSError:
+					pass
+		self.server = None
+		self.sock = None
@@ -0,0 +1,128 @@
+import json
+
+#----------Variables----------
+FRAME_END = b"\r\n" #Every message from the bulb ends with CRLF
+#Types of the values returned by get_prop and reported in props notifications
+PROP_TYPES = {"power": str, "bright": int, "ct": int, "rgb": int, "hue": int, "sat": int,
+	"color_mode": int, "flowing": int, "delayoff": int, "flow_params": str, "music_on": int, "name": str}
+_decoder = json.JSONDecoder()
+#Pre-quoted request strings, see quoted()
+QUOTED = {text: "\"" + text + "\"" for text in ("sudden", "smooth", "on", "off",
+	"color", "hsv", "ct", "cf", "auto_delay_off", "increase", "decrease", "circle", "bright")}
+_templates = {} #{method: (number of params, request template)}, see encode_request()
+
+#Line reader class
+class LineReader:
+	"""
+	Incremental framing of the bulb's TCP stream.
+	feed() accepts whatever recv() returned - half a message or several coalesced ones -
+	and returns the list of complete, parsed frames. Unterminated data waits for the next feed().
+	"""
+	def __init__(self):
+		self.buffer = b""
+
+	def feed(self, data):
+		"""Adds received bytes, returns the list of complete frames (dicts)"""
+		if self.buffer:
+			data = self.buffer + data
+		lines = data.split(FRAME_END)
+		self.buffer = lines.pop()
+		frames = []
+		for line in lines:
+			frame = parse_frame(line)
+			if frame is not None:
+				frames.append(frame)
+		return frames
+
+	def clear(self):
+		self.buffer = b""
+
+#----------Functions----------
+def quoted(text):
+	"""Request value for a string, e.g. quoted("smooth") -> '"smooth"' (prebuilt for the common ones)"""
+	value = QUOTED.get(text)
+	if value is None:
+		value = "\"" + str(text) + "\""
+	return value
+
+def parse_frame(line):
+	"""Decodes one JSON line, returns a dict or None if the line is empty or not valid JSON"""
+	if not line:
+		return None
+	try:
+		frame = _decoder.decode(line.decode() if isinstance(line, bytes) else line)
+	except ValueError: #Also covers UnicodeDecodeError
+		return None
+	if not isinstance(frame, dict):
+		return None
+	return frame
+
+def is_notification(frame):
+	"""True for {"method":"props","params":{...}} state change notifications"""
+	return frame.get("method") == "props" and "id" not in frame
+
+def convert_prop(prop, value):
+	"""Converts a property value reported as string to its type, "" (not available) becomes None"""
+	if value == "" or value is None:
+		return None
+	prop_type = PROP_TYPES.get(prop, str)
+	if prop_type is int:
+		try:
+			return int(value)
+		except (TypeError, ValueError):
+			return value
+	return str(value)
+
+def convert_props(props, values):
+	"""Converts the get_prop result list matching the requested 'props'"""
+	return [convert_prop(prop, value) for prop, value in zip(props, values)]
+
+def result_from_frame(method, frame):
+	"""
+	Turns a reply frame into the YeeBulb result tuple.
+	(False, message) for errors, (True, "ok") for plain acknowledgements,
+	(True, result list) for get_prop/cron_get.
+	"""
+	if "error" in frame:
+		error = frame["error"]
+		if isinstance(error, dict):
+			return (False, error.get("message", str(error)))
+		return (False, str(error))
+	if "result" not in frame:
+		return (False, "Unknown error.\n Received data:\n" + json.dumps(frame))
+	result = frame["result"]
+	if method == "get_prop" or method == "cron_get":
+		return (True, result)
+	if result == ["ok"] or result == "ok":
+		return (True, "ok")
+	return (True, result)
+
+def request_tail(method, params):
+	"""
+	Wire bytes of a request after its id: ,"method":"...","params":[...]}\r\n
+	Built once for requests that are sent again and again (see YeeScene), only the id changes per send.
+	"""
+	return (",\"method\":\"" + method + "\",\"params\":[" + params + "]}\r\n").encode()
+
+def encode_request(msg_id, method, params):
+	"""
+	Encodes one request line.
+	'params' is one of:
+		a tuple of values, written as str() writes them (use quoted() for strings), e.g. (50, quoted("smooth"), 500)
+		a params string, e.g. "50,\"smooth\",500"
+		the bytes returned by request_tail() for a precompiled request
+	A tuple is formatted with one % operation into a template built once per method, instead of
+	concatenating a new string per value. All three forms give the same bytes.
+	"""
+	if type(params) is tuple:
+		template = _templates.get(method)
+		if template is None or template[0] != len(params):
+			template = _templates[method] = (len(params), request_template(method, len(params)))
+		return (template[1] % ((msg_id,) + params)).encode()
+	if isinstance(params, bytes):
+		return b"{\"id\":" + str(msg_id).encode() + params
+	return ("{\"id\":" + str(msg_id) + ",\"method\":\"" + method + "\",\"params\":[" + params + "]}\r\n").encode()
+
+def request_template(method, count):
+	"""Request line with %s for the id and 'count' params"""
+	return "{\"id\":%s,\"method\":\"" + method.replace("%", "%%") + "\",\"params\":[" + ",".join(["%s"] * count) + "]}\r\n"
@@ -0,0 +1,97 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+#----------Variables----------
+#Writes where only the latest target matters {method: property it sets}
+#rgb, hsv and ct all set the color, so a newer one of any of them supersedes the others
+COALESCE_KEYS = {"set_bright": "bright", "set_rgb": "color", "set_hsv": "color", "set_ct_abx": "color"}
+
+#Queue entry class
+class QueueEntry:
+	def __init__(self, method, params, key):
+		self.method = method
+		self.params = params
+		self.key = key
+		self.future = Future()
+
+#Command queue class
+class YeeCommandQueue:
+	"""
+	Per-bulb send queue that collapses superseded writes before they hit the wire.
+	A new set_bright/set_rgb/set_hsv/set_ct_abx replaces a pending, not yet sent write of the
+	same property, so a slider dragged across 50 values sends only the latest one.
+	Every other command (toggle, set_power, start_cf, get_prop, ...) is an ordering barrier:
+	writes queued after it never replace writes queued before it.
+	Args:
+		send: callable(method, params) -> result tuple, used by the worker thread
+		idle_timeout: the worker thread exits after being idle this long (s), put() restarts it
+	"""
+	def __init__(self, send, idle_timeout = 5):
+		self.send = send
+		self.idle_timeout = idle_timeout
+		self.entries = deque()
+		self.coalesced = 0 #Writes replaced before being sent
+		self.sent = 0
+		self.worker = None
+		self._cond = threading.Condition()
+		self._closed = False
+
+	def put(self, method, params):
+		"""
+		Queues a command, returns a concurrent.futures.Future for its result tuple.
+		A replaced write shares the future of the write that replaced it.
+		"""
+		key = COALESCE_KEYS.get(method)
+		with self._cond:
+			if self._closed:
+				future = Future()
+				future.set_result((False, "Command queue is closed"))
+				return future
+			if key is not None:
+				for entry in reversed(self.entries):
+					if entry.key is None:
+						break #Ordering barrier
+					if entry.key == key:
+						entry.method = method
+						entry.params = params
+						self.coalesced += 1
+						return entry.future
+			entry = QueueEntry(method, params, key)
+			self.entries.append(entry)
+			if self.worker is None:
+				self.worker = threading.Thread(target=self._run, daemon=True)
+				self.worker.start()
+			self._cond.notify()
+		return entry.future
+
+	def depth(self):
+		"""Number of commands waiting to be sent"""
+		with self._cond:
+			return len(self.entries)
+
+	def close(self):
+		"""Stops the worker, pending commands resolve to (False, ...)"""
+		with self._cond:
+			self._closed = True
+			entries = list(self.entries)
+			self.entries.clear()
+			self._cond.notify_all()
+		for entry in entries:
+			entry.future.set_result((False, "Command queue is closed"))
+
+	def _run(self):
+		while True:
+			with self._cond:
+				if not self.entries and not self._closed:
+					self._cond.wait(self.idle_timeout)
+				if not self.entries or self._closed:
+					self.worker = None
+					return
+				entry = self.entries.popleft()
+			try:
+				result = self.send(entry.method, entry.params)
+			except Exception as e:
+				result = (False, e)
+			self.sent += 1
+			entry.future.set_result(result)
@@ -0,0 +1,130 @@
+import threading
+import time
+
+#Rate limiter class
+class YeeRateLimiter:
+	"""
+	Token bucket keeping one bulb's commands within its quota.
+	Outside music mode the firmware accepts about 60 commands per minute and silently drops
+	or rejects the rest. Every command reserves a token; when the bucket is empty the reservation
+	is scheduled 1/rate later than the previous one, so queued commands are spread evenly over
+	the quota in arrival order instead of failing.
+	The bucket refills at (rate - burst) / period, so a full bucket plus one window of refill
+	never exceeds 'rate' commands in any 'period' seconds.
+	Args:
+		rate: commands allowed per 'period'
+		period: length of the quota window (s)
+		burst: bucket size, commands that may go out back to back after an idle period (less than 'rate')
+		burst_threshold: commands in a row that found the bucket empty, whether they queued up together
+			or came one after another, that count as a burst; on_burst() is called once per burst
+		on_burst: callback for bursty workloads (YeeBulb switches to music mode), called by the
+			reserving thread before it waits
+	"""
+	__slots__ = ("rate", "capacity", "tokens", "updated", "burst_threshold", "on_burst", "bursting", "streak",
+		"queue_depth", "commands", "delayed", "wait_total", "wait_max", "_lock", "_wakeup")
+	def __init__(self, rate = 60, period = 60.0, burst = 5, burst_threshold = 3, on_burst = None):
+		if burst >= rate:
+			raise ValueError("burst must be smaller than rate")
+		self.rate = float(rate - burst) / period #Tokens per second
+		self.capacity = float(burst)
+		self.tokens = float(burst)
+		self.updated = time.monotonic()
+		self.burst_threshold = burst_threshold
+		self.on_burst = on_burst
+		self.bursting = False
+		self.streak = 0 #Commands in a row that had to wait, reset by one that finds a token
+		self.queue_depth = 0 #Commands currently waiting for their slot
+		self.commands = 0 #Commands that went through the limiter
+		self.delayed = 0 #Commands that had to wait
+		self.wait_total = 0.0
+		self.wait_max = 0.0
+		self._lock = threading.Lock()
+		self._wakeup = threading.Condition() #Notified by wake()
+
+	def reserve(self, max_wait = None):
+		"""
+		Takes a token and returns how long (s) the caller has to wait before sending.
+		A waiting caller is counted in 'queue_depth' until it calls finish().
+		Returns None without taking a token if the wait would exceed 'max_wait'.
+		"""
+		burst = False
+		with self._lock:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			wait = 0.0
+			if self.tokens < 1:
+				wait = (1 - self.tokens) / self.rate
+				if max_wait is not None and wait > max_wait:
+					return None
+			self.tokens -= 1
+			self.commands += 1
+			if wait > 0:
+				self.queue_depth += 1
+				self.delayed += 1
+				self.wait_total += wait
+				self.wait_max = max(self.wait_max, wait)
+				self.streak += 1
+				if self.burst_threshold is not None and self.streak >= self.burst_threshold and not self.bursting:
+					self.bursting = True
+					burst = True
+			else:
+				self.streak = 0
+				self.bursting = False
+		if burst and self.on_burst is not None:
+			self.on_burst()
+		return wait
+
+	def finish(self, wait):
+		"""Ends a reservation that returned 'wait' > 0"""
+		if wait:
+			with self._lock:
+				self.queue_depth -= 1
+
+	def force(self):
+		"""Takes a token without waiting, the bucket may go below empty (later reservations wait longer)"""
+		with self._lock:
+			self.tokens -= 1
+			self.commands += 1
+
+	def acquire(self, max_wait = None, until = None):
+		"""
+		Blocking reserve(): sleeps until the command may be sent. Returns the time waited or None.
+		'until' - callable checked before sleeping and after every wake(); once it returns True
+		the wait ends early and the token goes back to the bucket (e.g. music mode came on).
+		"""
+		wait = self.reserve(max_wait)
+		if wait:
+			start = time.monotonic()
+			due = start + wait
+			try:
+				with self._wakeup:
+					while True:
+						left = due - time.monotonic()
+						if left <= 0:
+							break
+						if until is not None and until():
+							with self._lock:
+								self.tokens += 1
+							return time.monotonic() - start
+						self._wakeup.wait(left)
+			finally:
+				self.finish(wait)
+		return wait
+
+	def wake(self):
+		"""Makes waiting acquire() calls check their 'until' condition"""
+		with self._wakeup:
+			self._wakeup.notify_all()
+
+	def stats(self):
+		"""Returns queue depth and wait time statistics"""
+		with self._lock:
+			return {
+				"queue_depth": self.queue_depth,
+				"commands": self.commands,
+				"delayed": self.delayed,
+				"wait_total": self.wait_total,
+				"wait_max": self.wait_max,
+				"wait_avg": self.wait_total / self.delayed if self.delayed else 0.0,
+			}
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+import YeeMetrics
+
+#Bulb registry class
+class BulbRegistry:
+	"""
+	Thread-safe registry of known bulbs, keyed by the bulb's hardware id.
+	Bulbs are also indexed by ip, by name and by a short index (bulb.id) used by the CLI.
+	The index is never reused and a bulb that comes back after expiring gets its old one,
+	so indexes stay stable across refreshes.
+	An entry expires 'max-age' seconds (from the bulb's Cache-Control header) after we last
+	heard from the bulb - an advertisement, a reply or a notification. Expired bulbs are closed
+	so calls to them fail at once instead of waiting for a dead device.
+	Listeners are called as listener(event, bulb) with event "added", "updated", "expired" or "removed".
+	"""
+	def __init__(self, default_max_age = 3600):
+		self.default_max_age = default_max_age
+		self.bulbs = {} #{hardware id: bulb}
+		self.by_ip = {} #{ip: hardware id}
+		self.by_name = {} #{name: hardware id}
+		self.by_index = {} #{bulb.id: hardware id}
+		self.max_age = {} #{hardware id: max-age (s)}
+		self.next_index = 1
+		self.indexes = {} #{hardware id: index}, kept after expiry
+		self.listeners = []
+		self._lock = threading.RLock()
+
+	def __len__(self):
+		return len(self.bulbs)
+
+	def values(self):
+		"""Returns a snapshot list of the registered bulbs, ordered by index"""
+		with self._lock:
+			return sorted(self.bulbs.values(), key = lambda bulb: bulb.id)
+
+	def add_listener(self, listener):
+		self.listeners.append(listener)
+
+	def notify(self, event, bulb):
+		metrics = YeeMetrics.collector
+		if metrics is not None:
+			metrics.discovery(event)
+		for listener in list(self.listeners):
+			try:
+				listener(event, bulb)
+			except Exception:
+				pass
+
+	def update(self, response, factory):
+		"""
+		Adds or updates a bulb from a parsed search response (see YeeDiscovery).
+		'factory' builds new bulbs: factory(index, ip, port, model, name, methods).
+		Returns (bulb, added).
+		"""
+		with self._lock:
+			hw_id = response["id"]
+			bulb = self.bulbs.get(hw_id)
+			if bulb is None:
+				index = self.indexes.get(hw_id)
+				if index is None:
+					index = self.next_index
+					self.next_index += 1
+					self.indexes[hw_id] = index
+				bulb = factory(index, response["ip"], response["port"], response["model"], response["name"], response["support"])
+				bulb.hw_id = hw_id
+				bulb.update_state(response["props"])
+				self.bulbs[hw_id] = bulb
+				self.by_index[bulb.id] = hw_id
+				added = True
+			else:
+				if self.by_ip.get(bulb.ip) == hw_id:
+					del self.by_ip[bulb.ip]
+				if self.by_name.get(bulb.name) == hw_id:
+					del self.by_name[bulb.name]
+				bulb.update_info(response)
+				added = False
+			self.by_ip[bulb.ip] = hw_id
+			if bulb.name:
+				self.by_name[bulb.name] = hw_id
+			self.max_age[hw_id] = response.get("max_age", self.default_max_age)
+			bulb.touch()
+		self.notify("added" if added else "updated", bulb)
+		return (bulb, added)
+
+	def touch(self, hw_id):
+		"""Records that the bulb was heard from (e.g. a duplicate advertisement), False if unknown"""
+		bulb = self.get(hw_id)
+		if bulb is None:
+			return False
+		bulb.touch()
+		return True
+
+	def get(self, hw_id):
+		with self._lock:
+			return self.bulbs.get(hw_id)
+
+	def get_by_ip(self, ip):
+		with self._lock:
+			return self.bulbs.get(self.by_ip.get(ip))
+
+	def get_by_name(self, name):
+		with self._lock:
+			return self.bulbs.get(self.by_name.get(name))
+
+	def get_by_index(self, index):
+		with self._lock:
+			return self.bulbs.get(self.by_index.get(int(index)))
+
+	def find(self, target):
+		"""Looks a bulb up by index, name, ip or hardware id, returns None if unknown"""
+		with self._lock:
+			try:
+				bulb = self.get_by_index(int(float(target)))
+				if bulb is not None:
+					return bulb
+			except ValueError:
+				pass
+			return self.get_by_name(target) or self.get_by_ip(target) or self.get(target)
+
+	def alive(self, bulb, now = None):
+		"""True if we heard from the bulb within its max-age"""
+		if now is None:
+			now = time.monotonic()
+		max_age = self.max_age.get(bulb.hw_id, self.default_max_age)
+		return now - bulb.last_seen <= max_age
+
+	def remove(self, hw_id, event = "removed"):
+		"""Drops a bulb and closes its connections"""
+		with self._lock:
+			bulb = self.bulbs.pop(hw_id, None)
+			if bulb is None:
+				return None
+			if self.by_ip.get(bulb.ip) == hw_id:
+				del self.by_ip[bulb.ip]
+			if self.by_name.get(bulb.name) == hw_id:
+				del self.by_name[bulb.name]
+			self.by_index.pop(bulb.id, None)
+			self.max_age.pop(hw_id, None)
+		closing = bulb.close()
+		if asyncio.iscoroutine(closing): #AsyncYeeBulb
+			asyncio.ensure_future(closing)
+		self.notify(event, bulb)
+		return bulb
+
+	def expire(self, now = None):
+		"""Removes bulbs we have not heard from within their max-age, returns them"""
+		if now is None:
+			now = time.monotonic()
+		with self._lock:
+			dead = [hw_id for hw_id, bulb in self.bulbs.items() if not self.alive(bulb, now)]
+		return [self.remove(hw_id, "expired") for hw_id in dead]
+
+	def clear(self):
+		"""Removes all bulbs, indexes keep counting up"""
+		with self._lock:
+			hw_ids = list(self.bulbs)
+		for hw_id in hw_ids:
+			self.remove(hw_id)
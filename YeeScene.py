@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+from YeeFlow import Flow, ACTION_RECOVER, ACTION_OFF, CT_RANGE, RGB_MAX, check_step, flow_params
+from YeeProtocol import request_tail
+
+#----------Variables----------
+SCENE_CLASSES = ("color", "hsv", "ct", "cf", "auto_delay_off")
+
+#----------Functions----------
+def check_range(value, low, high, name):
+	"""Returns int(value), raises ValueError if it is not within low..high"""
+	value = int(value)
+	if not low <= value <= high:
+		raise ValueError(name + " out of range")
+	return value
+
+def check_args(class_type, args, count):
+	if len(args) != count:
+		raise ValueError("\"" + class_type + "\" takes " + str(count) + " arguments")
+
+def scene_params(class_type, *args):
+	"""
+	Validates set_scene arguments, returns the params string.
+	Raises ValueError (or TypeError) for unknown classes, wrong argument counts and values out of range.
+		"color", rgb, bright
+		"hsv", hue, sat, bright
+		"ct", ct, bright
+		"cf", count, action, (duration, mode, value, bright), ... or "cf", Flow
+		"auto_delay_off", bright, minutes
+	"""
+	if class_type == "color":
+		check_args(class_type, args, 2)
+		values = (check_range(args[0], 0, RGB_MAX, "rgb"), check_range(args[1], 1, 100, "bright"))
+	elif class_type == "hsv":
+		check_args(class_type, args, 3)
+		values = (check_range(args[0], 0, 359, "hue"), check_range(args[1], 0, 100, "sat"),
+			check_range(args[2], 1, 100, "bright"))
+	elif class_type == "ct":
+		check_args(class_type, args, 2)
+		values = (check_range(args[0], CT_RANGE[0], CT_RANGE[1], "ct"), check_range(args[1], 1, 100, "bright"))
+	elif class_type == "cf":
+		if len(args) == 1 and isinstance(args[0], Flow):
+			return "\"cf\"," + args[0].compile()
+		if len(args) < 3:
+			raise ValueError("\"cf\" takes count, action and at least one flow expression")
+		count = check_range(args[0], 0, 2 ** 31, "count")
+		action = check_range(args[1], ACTION_RECOVER, ACTION_OFF, "action")
+		steps = [check_step(*expression) for expression in args[2:]]
+		return "\"cf\"," + flow_params(count, action, steps)
+	elif class_type == "auto_delay_off":
+		check_args(class_type, args, 2)
+		values = (check_range(args[0], 1, 100, "bright"), check_range(args[1], 1, 2 ** 31, "minutes"))
+	else:
+		raise ValueError("Unknown scene class " + str(class_type))
+	return "\"" + class_type + "\"," + ",".join(str(value) for value in values)
+
+def scene_payload(class_type, *args):
+	"""Validated set_scene request as wire bytes after the id, see YeeProtocol.request_tail()"""
+	return request_tail("set_scene", scene_params(class_type, *args))
+
+#Scene library class
+class SceneLibrary:
+	"""
+	Named scenes.
+	define() validates a scene once; recalling it sends bytes compiled on first use, so setting
+	a scene on many bulbs only prepends the message id and writes the buffer.
+	The compiled payloads of the 'maxsize' most recently used scenes are kept (LRU),
+	evicted ones are recompiled from their definition on the next recall.
+		scenes.define("reading", "ct", 4000, 100)
+		group.recall_scene("reading")
+	"""
+	def __init__(self, maxsize = 64):
+		self.maxsize = maxsize
+		self.definitions = {} #{name: (class_type, args)}
+		self.compiled = OrderedDict() #{name: bytes}, least recently used first
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+
+	def __contains__(self, name):
+		return name in self.definitions
+
+	def __len__(self):
+		return len(self.definitions)
+
+	def define(self, name, class_type, *args):
+		"""Adds or replaces a named scene, raises ValueError if the arguments are invalid"""
+		if class_type == "cf" and len(args) == 1 and isinstance(args[0], Flow):
+			args = (args[0].compile(),) #Later changes to the Flow do not alter the scene
+		payload = self.compile(class_type, args)
+		with self._lock:
+			self.definitions[name] = (class_type, args)
+			self.store(name, payload)
+
+	def remove(self, name):
+		with self._lock:
+			self.definitions.pop(name, None)
+			self.compiled.pop(name, None)
+
+	def payload(self, name):
+		"""Wire bytes of the named scene, raises KeyError for unknown names"""
+		with self._lock:
+			payload = self.compiled.get(name)
+			if payload is not None:
+				self.compiled.move_to_end(name)
+				self.hits += 1
+				return payload
+			class_type, args = self.definitions[name]
+			self.misses += 1
+			payload = self.compile(class_type, args)
+			self.store(name, payload)
+			return payload
+
+	@staticmethod
+	def compile(class_type, args):
+		if class_type == "cf" and len(args) == 1 and isinstance(args[0], str):
+			return request_tail("set_scene", "\"cf\"," + args[0]) #Compiled Flow
+		return scene_payload(class_type, *args)
+
+	def store(self, name, payload):
+		"""Caches a compiled payload, the caller holds the lock"""
+		self.compiled[name] = payload
+		self.compiled.move_to_end(name)
+		while len(self.compiled) > self.maxsize:
+			self.compiled.popitem(last = False)
+
+#The library used by YeeBulb.recall_scene()
+scenes = SceneLibrary()
@@ -0,0 +1,233 @@
+import heapq
+import itertools
+import threading
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from YeeGroup import BulbGroup
+
+#Scheduled job class
+class ScheduledJob:
+	"""A pending action, returned by YeeScheduler so it can be cancelled"""
+	def __init__(self, scheduler, due, action, args, repeat = None, name = None):
+		self.scheduler = scheduler
+		self.due = due #time.monotonic() to fire at
+		self.action = action
+		self.args = args
+		self.repeat = repeat #repeat(due) -> the next due time, None for one-off jobs
+		self.name = name
+		self.cancelled = False
+		self.queued = False #In the scheduler's heap, i.e. due to fire
+		self.runs = 0
+		self.late = 0.0 #How late (s) the last run fired
+		self.result = None #concurrent.futures.Future of the last run
+
+	def cancel(self):
+		self.scheduler.cancel(self)
+
+#Scheduler class
+class YeeScheduler:
+	"""
+	Host-side timer for scene changes, shared by all jobs.
+	Jobs wait in one heap ordered by due time and a single thread sleeps until the earliest one,
+	so thousands of pending jobs cost no CPU while idle and scheduling or cancelling is O(log n).
+	Due actions run on the scheduler's own executor, so a slow bulb does not delay the jobs after it.
+	It is separate from the BulbGroup executor: group actions fan out there and wait (at most
+	GROUP_TIMEOUT) for the members, which must not queue behind the jobs they are waiting for.
+	Times are kept on the monotonic clock; at() and daily() convert wall-clock times when scheduling.
+		scheduler.daily(7, 30, group.set_scene, "ct", 4000, 100)
+		scheduler.delay_off(bulb, 30 * 60) #Handed to the bulb's own timer
+	Works with YeeBulb and BulbGroup targets (not AsyncYeeBulb).
+	Args:
+		executor: runs the actions (default: a pool of MAX_WORKERS threads, never the BulbGroup executor)
+	"""
+	COMPACT_MIN = 64 #Rebuild the heap when more than this many and half of the jobs are cancelled
+	MAX_WORKERS = 8 #Threads running due actions
+	GROUP_TIMEOUT = 10.0 #Time limit (s) for a BulbGroup action run by a job
+
+	def __init__(self, executor = None):
+		self.executor = executor
+		self.own_executor = executor is None #Created by _run(), shut down by close()
+		self.jobs = [] #Heap of (due, seq, job)
+		self.seq = itertools.count()
+		self.cancelled = 0 #Cancelled jobs still in the heap
+		self.fired = 0
+		self.late_max = 0.0 #Worst firing delay seen (s)
+		self.worker = None
+		self._cond = threading.Condition()
+		self._closed = False
+
+	def schedule(self, due, action, *args, repeat = None, name = None):
+		"""Runs action(*args) at time.monotonic() 'due', returns the ScheduledJob"""
+		job = ScheduledJob(self, due, action, args, repeat, name)
+		with self._cond:
+			if self._closed:
+				raise RuntimeError("Scheduler is closed")
+			self.push(job)
+			if self.worker is None:
+				self.worker = threading.Thread(target=self._run, daemon=True)
+				self.worker.start()
+		return job
+
+	def after(self, delay, action, *args, name = None):
+		"""Runs action(*args) in 'delay' seconds"""
+		return self.schedule(time.monotonic() + delay, action, *args, name = name)
+
+	def at(self, when, action, *args, name = None):
+		"""Runs action(*args) at wall-clock time 'when' (datetime or time.time() seconds)"""
+		return self.schedule(YeeScheduler.to_monotonic(when), action, *args, name = name)
+
+	def every(self, interval, action, *args, first = None, name = None):
+		"""Runs action(*args) every 'interval' seconds, the first time after 'first' seconds (default 'interval')"""
+		first = interval if first is None else first
+		return self.schedule(time.monotonic() + first, action, *args, repeat = lambda due: due + interval, name = name)
+
+	def daily(self, hour, minute, action, *args, second = 0, name = None):
+		"""Runs action(*args) every day at hour:minute:second local time"""
+		def next_due(due = None):
+			now = datetime.datetime.now()
+			when = now.replace(hour = hour, minute = minute, second = second, microsecond = 0)
+			if when <= now + datetime.timedelta(seconds = 1):
+				when += datetime.timedelta(days = 1)
+			return YeeScheduler.to_monotonic(when) #Recomputed every day, follows DST changes
+		return self.schedule(next_due(), action, *args, repeat = next_due, name = name)
+
+	def scene(self, when, target, method, *args, name = None):
+		"""Calls target.<method>(*args) at wall-clock time 'when', 'target' is a YeeBulb or a BulbGroup"""
+		return self.at(when, YeeScheduler.call, target, method, args, name = name)
+
+	def delay_off(self, target, delay):
+		"""
+		Turns 'target' (YeeBulb or BulbGroup) off in 'delay' seconds.
+		Whole minutes are handed to each bulb's own timer (cron_add): nothing waits on the host and
+		the bulbs turn off even if the controller goes away. Other delays, bulbs without cron_add and
+		bulbs that rejected it get a host job. Returns that job, or None if everything was handed off.
+		"""
+		bulbs = YeeScheduler.members(target)
+		host = bulbs
+		if delay >= 60 and delay % 60 == 0:
+			host = self.offload(bulbs, "cron_add", (int(delay // 60),))
+		if not host:
+			return None
+		return self.after(delay, YeeScheduler.call, BulbGroup("delay_off", host), "turn_off", ())
+
+	def on_then_off(self, target, bright, delay):
+		"""
+		Turns 'target' on at 'bright' now and off in 'delay' seconds.
+		Whole minutes use set_scene "auto_delay_off" on the bulb, otherwise the bulbs are switched on
+		here and delay_off() schedules the rest. Returns the host job or None.
+		"""
+		bulbs = YeeScheduler.members(target)
+		host = bulbs
+		if delay >= 60 and delay % 60 == 0:
+			host = self.offload(bulbs, "set_scene", ("auto_delay_off", bright, int(delay // 60)))
+		if not host:
+			return None
+		group = BulbGroup("on_then_off", host)
+		group.turn_on()
+		group.set_bright(bright)
+		return self.delay_off(group, delay)
+
+	def offload(self, bulbs, method, args):
+		"""Sends 'method' to the bulbs that support it, returns the bulbs that still need a host job"""
+		supported = [bulb for bulb in bulbs if bulb.supports_method(method)]
+		host = [bulb for bulb in bulbs if not bulb.supports_method(method)]
+		if supported:
+			ok, results = BulbGroup(method, supported).call(method, *args, timeout = YeeScheduler.GROUP_TIMEOUT)
+			host += [bulb for bulb in supported if not results[bulb.id][0]]
+		return host
+
+	@staticmethod
+	def members(target):
+		if isinstance(target, BulbGroup):
+			return list(target)
+		return [target]
+
+	@staticmethod
+	def call(target, method, args):
+		if isinstance(target, BulbGroup):
+			return target.call(method, *args, timeout = YeeScheduler.GROUP_TIMEOUT)
+		return getattr(target, method)(*args)
+
+	@staticmethod
+	def to_monotonic(when):
+		"""Converts a wall-clock time (datetime or time.time() seconds) to time.monotonic()"""
+		if isinstance(when, datetime.datetime):
+			when = when.timestamp()
+		return time.monotonic() + (when - time.time())
+
+	def cancel(self, job):
+		"""Cancels a pending job, cancelled jobs are dropped from the heap lazily"""
+		with self._cond:
+			if job.cancelled:
+				return
+			job.cancelled = True
+			job.repeat = None
+			if not job.queued:
+				return #Already fired (or running), nothing left in the heap
+			self.cancelled += 1
+			if self.cancelled > YeeScheduler.COMPACT_MIN and self.cancelled * 2 > len(self.jobs):
+				self.jobs = [entry for entry in self.jobs if not entry[2].cancelled]
+				heapq.heapify(self.jobs)
+				self.cancelled = 0
+
+	def pending(self):
+		"""Number of jobs waiting to fire"""
+		with self._cond:
+			return len(self.jobs) - self.cancelled
+
+	def close(self):
+		"""Stops the timer thread, pending jobs are dropped"""
+		with self._cond:
+			self._closed = True
+			for entry in self.jobs:
+				entry[2].queued = False
+			self.jobs = []
+			self.cancelled = 0
+			self._cond.notify_all()
+		if self.worker is not None:
+			self.worker.join()
+			self.worker = None
+		if self.own_executor and self.executor is not None:
+			self.executor.shutdown(wait = False)
+			self.executor = None
+
+	def push(self, job):
+		"""Adds a job to the heap, the caller holds the lock"""
+		heapq.heappush(self.jobs, (job.due, next(self.seq), job))
+		job.queued = True
+		if self.jobs[0][2] is job:
+			self._cond.notify() #New earliest job, the worker sleeps until an older due time
+
+	def _run(self):
+		with self._cond:
+			if self.executor is None:
+				self.executor = ThreadPoolExecutor(max_workers = YeeScheduler.MAX_WORKERS, thread_name_prefix = "YeeScheduler")
+			executor = self.executor
+		while True:
+			with self._cond:
+				while not self._closed:
+					if not self.jobs:
+						self._cond.wait()
+						continue
+					wait = self.jobs[0][0] - time.monotonic()
+					if wait <= 0:
+						break
+					self._cond.wait(wait)
+				if self._closed:
+					return
+				_, _, job = heapq.heappop(self.jobs)
+				job.queued = False
+				if job.cancelled:
+					self.cancelled -= 1
+					continue
+				job.late = time.monotonic() - job.due
+				job.runs += 1
+				self.fired += 1
+				self.late_max = max(self.late_max, job.late)
+				if job.repeat is not None:
+					job.due = job.repeat(job.due)
+					if job.due is not None:
+						heapq.heappush(self.jobs, (job.due, next(self.seq), job))
+						job.queued = True
+			job.result = executor.submit(job.action, *job.args)
@@ -0,0 +1,474 @@
+import sys	#For sys.argv/sys.exit()
+import json
+import heapq
+import itertools
+import random
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from YeeProtocol import FRAME_END, parse_frame
+
+#----------Variables----------
+SUPPORTED_METHODS = ["get_prop", "set_default", "set_power", "toggle", "set_bright", "start_cf", "stop_cf", "set_scene",
+	"cron_add", "cron_get", "cron_del", "set_ct_abx", "set_rgb", "set_hsv", "set_adjust", "set_music", "set_name"]
+#Error messages of the firmware
+ERROR_COMMAND = "invalid command" #Not JSON, reply has "id": null
+ERROR_METHOD = "method not supported"
+ERROR_PARAMS = "invalid params"
+ERROR_QUOTA = "client quota exceeded"
+ADJUST_STEPS = {"bright": (10, 1, 100), "ct": (500, 1700, 6500)} #{prop: (step, min, max)} for set_adjust
+
+#Simulated bulb class
+class SimulatedBulb:
+	"""
+	State and command handling of one virtual bulb, served by Simulator.
+	Commands change the state at once (gradual transitions are not simulated) and every change
+	is pushed to all connected clients as a props notification, unless music mode is on.
+	Firmware behaviour that is modelled:
+		quota: at most 'quota' commands per 'period' seconds outside music mode, the rest get ERROR_QUOTA
+		max_connections: further TCP connections are closed right after accept
+		set_adjust: "color" only accepts "circle"; requests that are not valid JSON
+			(e.g. unquoted strings) get ERROR_COMMAND with "id": null
+	Args:
+		index: makes the hardware id and default name unique
+		latency: delay (s) of every reply, notification and search response
+		loss: probability (0-1) that a request or a search response is silently dropped
+	"""
+	def __init__(self, index, host = "127.0.0.1", model = "color", name = "", quota = 60, period = 60.0,
+			max_connections = 4, latency = 0.0, loss = 0.0):
+		self.index = index
+		self.hw_id = "0x%016x" % (0x15243f + index)
+		self.host = host
+		self.port = None
+		self.model = model
+		self.quota = quota
+		self.period = period
+		self.max_connections = max_connections
+		self.latency = latency
+		self.loss = loss
+		self.state = {"power": "on", "bright": 100, "ct": 4000, "rgb": 16711680, "hue": 100, "sat": 35, "color_mode": 2,
+			"flowing": 0, "delayoff": 0, "flow_params": "", "music_on": 0, "name": name}
+		self.default = dict(self.state)
+		self.server = None
+		self.clients = [] #Normal TCP connections
+		self.music = None #Music mode connection
+		self.recent = deque() #time.monotonic() of the commands within the quota period
+		self.received = 0 #Commands handled
+		self.dropped = 0 #Requests lost on purpose ('loss')
+		self.rejected = 0 #Commands over the quota
+		self.handlers = {method: getattr(self, "cmd_" + method) for method in SUPPORTED_METHODS}
+
+	def search_response(self, notify = False):
+		"""Search response (or NOTIFY advertisement) in the format of Doc/Notes.txt"""
+		if notify:
+			msg = "NOTIFY * HTTP/1.1\r\nHost: 239.255.255.250:1982\r\n"
+		else:
+			msg = "HTTP/1.1 200 OK\r\n"
+		msg += "Cache-Control: max-age=3600\r\nDate: \r\nExt: \r\n"
+		msg += "Location: yeelight://" + self.host + ":" + str(self.port) + "\r\n"
+		msg += "Server: POSIX UPnP/1.0 YGLC/1\r\n"
+		msg += "id: " + self.hw_id + "\r\nmodel: " + self.model + "\r\nfw_ver: 18\r\n"
+		msg += "support: " + " ".join(SUPPORTED_METHODS) + "\r\n"
+		for prop in ["power", "bright", "color_mode", "ct", "rgb", "hue", "sat", "name"]:
+			msg += prop + ": " + str(self.state[prop]) + "\r\n"
+		return msg
+
+	def take_quota(self, now):
+		"""Counts a command against the quota, False if it is exhausted"""
+		while self.recent and now - self.recent[0] >= self.period:
+			self.recent.popleft()
+		if len(self.recent) >= self.quota:
+			return False
+		self.recent.append(now)
+		return True
+
+	def execute(self, method, params):
+		"""Runs a command, returns (result, {changed prop: value}). Raises ValueError(error message)."""
+		handler = self.handlers.get(method)
+		if handler is None:
+			raise ValueError(ERROR_METHOD)
+		if not isinstance(params, list):
+			raise ValueError(ERROR_PARAMS)
+		self.received += 1
+		return handler(params)
+
+	def change(self, **props):
+		"""Applies property changes, returns (["ok"], the props that actually changed)"""
+		changed = {prop: value for prop, value in props.items() if self.state.get(prop) != value}
+		self.state.update(changed)
+		return (["ok"], changed)
+
+	@staticmethod
+	def int_param(params, index, low, high):
+		try:
+			value = int(params[index])
+		except (IndexError, TypeError, ValueError):
+			raise ValueError(ERROR_PARAMS)
+		if not low <= value <= high:
+			raise ValueError(ERROR_PARAMS)
+		return value
+
+	@staticmethod
+	def check_effect(params, index):
+		"""Validates the optional effect/duration pair starting at params[index]"""
+		if len(params) > index and params[index] not in ("sudden", "smooth"):
+			raise ValueError(ERROR_PARAMS)
+		if len(params) > index + 1:
+			SimulatedBulb.int_param(params, index + 1, 30 if params[index] == "smooth" else 0, 2 ** 31)
+
+	def cmd_get_prop(self, params):
+		return ([str(self.state.get(prop, "")) for prop in params], {})
+
+	def cmd_set_default(self, params):
+		self.default = dict(self.state)
+		return (["ok"], {})
+
+	def cmd_set_power(self, params):
+		if not params or params[0] not in ("on", "off"):
+			raise ValueError(ERROR_PARAMS)
+		self.check_effect(params, 1)
+		return self.change(power = params[0])
+
+	def cmd_toggle(self, params):
+		return self.change(power = "off" if self.state["power"] == "on" else "on")
+
+	def cmd_set_bright(self, params):
+		bright = self.int_param(params, 0, 1, 100)
+		self.check_effect(params, 1)
+		return self.change(bright = bright)
+
+	def cmd_set_ct_abx(self, params):
+		ct = self.int_param(params, 0, 1700, 6500)
+		self.check_effect(params, 1)
+		return self.change(ct = ct, color_mode = 2)
+
+	def cmd_set_rgb(self, params):
+		rgb = self.int_param(params, 0, 0, 16777215)
+		self.check_effect(params, 1)
+		return self.change(rgb = rgb, color_mode = 1)
+
+	def cmd_set_hsv(self, params):
+		hue = self.int_param(params, 0, 0, 359)
+		sat = self.int_param(params, 1, 0, 100)
+		self.check_effect(params, 2)
+		return self.change(hue = hue, sat = sat, color_mode = 3)
+
+	def cmd_start_cf(self, params):
+		self.int_param(params, 0, 0, 2 ** 31)
+		self.int_param(params, 1, 0, 2)
+		if len(params) < 3 or not isinstance(params[2], str):
+			raise ValueError(ERROR_PARAMS)
+		fields = params[2].split(",")
+		if len(fields) % 4 != 0:
+			raise ValueError(ERROR_PARAMS)
+		return self.change(flowing = 1, flow_params = params[2], power = "on")
+
+	def cmd_stop_cf(self, params):
+		return self.change(flowing = 0)
+
+	def cmd_set_scene(self, params):
+		scene = params[0] if params else None
+		if scene == "color":
+			return self.change(power = "on", rgb = self.int_param(params, 1, 0, 16777215), color_mode = 1,
+				bright = self.int_param(params, 2, 1, 100))
+		if scene == "hsv":
+			return self.change(power = "on", hue = self.int_param(params, 1, 0, 359), sat = self.int_param(params, 2, 0, 100),
+				color_mode = 3, bright = self.int_param(params, 3, 1, 100))
+		if scene == "ct":
+			return self.change(power = "on", ct = self.int_param(params, 1, 1700, 6500), color_mode = 2,
+				bright = self.int_param(params, 2, 1, 100))
+		if scene == "cf":
+			return self.cmd_start_cf(params[1:])
+		if scene == "auto_delay_off":
+			return self.change(power = "on", bright = self.int_param(params, 1, 1, 100),
+				delayoff = self.int_param(params, 2, 1, 2 ** 31))
+		raise ValueError(ERROR_PARAMS)
+
+	def cmd_cron_add(self, params):
+		self.int_param(params, 0, 0, 0)
+		return self.change(delayoff = self.int_param(params, 1, 1, 2 ** 31))
+
+	def cmd_cron_get(self, params):
+		self.int_param(params, 0, 0, 0)
+		if not self.state["delayoff"]:
+			return ([], {})
+		return ([{"type": 0, "delay": self.state["delayoff"], "mix": 0}], {})
+
+	def cmd_cron_del(self, params):
+		self.int_param(params, 0, 0, 0)
+		return self.change(delayoff = 0)
+
+	def cmd_set_adjust(self, params):
+		if len(params) < 2 or params[0] not in ("increase", "decrease", "circle"):
+			raise ValueError(ERROR_PARAMS)
+		action, prop = params[0], params[1]
+		if prop == "color":
+			if action != "circle":
+				raise ValueError(ERROR_PARAMS)
+			return self.change(hue = (self.state["hue"] + 30) % 360, color_mode = 3)
+		if prop not in ADJUST_STEPS:
+			raise ValueError(ERROR_PARAMS)
+		step, low, high = ADJUST_STEPS[prop]
+		value = self.state[prop] + (-step if action == "decrease" else step)
+		if action == "circle" and value > high:
+			value = low
+		return self.change(**{prop: min(high, max(low, value))})
+
+	def cmd_set_music(self, params):
+		#The connection itself is made by Simulator
+		action = self.int_param(params, 0, 0, 1)
+		if action == 1 and (len(params) < 3 or not isinstance(params[1], str)):
+			raise ValueError(ERROR_PARAMS)
+		return (["ok"], {})
+
+	def cmd_set_name(self, params):
+		if not params or not isinstance(params[0], str):
+			raise ValueError(ERROR_PARAMS)
+		return self.change(name = params[0])
+
+#Simulator class
+class Simulator:
+	"""
+	N virtual bulbs on localhost, for tests and benchmarks without hardware.
+	Each bulb listens on its own TCP port and serves the JSON-RPC protocol; one UDP socket answers
+	M-SEARCH requests for all of them. Point the controller at it with
+		sim = Simulator(10, loss = 0.01)
+		sim.start()
+		controller = YeeLightController(search_address = sim.search_address, listen_port = 0)
+	Everything runs in one selector thread; replies are scheduled 'latency' seconds ahead.
+	Args:
+		count: number of bulbs
+		host: address the bulbs listen on and advertise
+		search_port: UDP port for M-SEARCH (0 - any free port, see search_address)
+		seed: seeds the packet loss, for reproducible runs
+		options: passed to every SimulatedBulb (quota, period, max_connections, latency, loss, model)
+	"""
+	def __init__(self, count = 1, host = "127.0.0.1", search_port = 0, seed = None, **options):
+		self.host = host
+		self.search_port = search_port
+		self.random = random.Random(seed)
+		self.bulbs = [SimulatedBulb(index + 1, host, **options) for index in range(count)]
+		self.search_socket = None
+		self.selector = None
+		self.outbox = [] #Heap of (due, seq, sock, data, address) waiting for their latency
+		self.buffers = {} #{client socket: unterminated data}
+		self.seq = itertools.count()
+		self.thread = None
+		self.running = False
+		self.wakeup_recv = None
+		self.wakeup_send = None
+		self._lock = threading.Lock()
+
+	@property
+	def search_address(self):
+		"""(host, port) to send M-SEARCH requests to"""
+		return (self.host, self.search_port)
+
+	def start(self):
+		"""Opens all sockets and starts serving"""
+		if self.thread is not None:
+			return
+		self.selector = selectors.DefaultSelector()
+		self.search_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.search_socket.bind((self.host, self.search_port))
+		self.search_port = self.search_socket.getsockname()[1]
+		self.selector.register(self.search_socket, selectors.EVENT_READ, ("search", None))
+		for bulb in self.bulbs:
+			bulb.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			bulb.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			bulb.server.bind((self.host, 0))
+			bulb.server.listen(16)
+			bulb.port = bulb.server.getsockname()[1]
+			self.selector.register(bulb.server, selectors.EVENT_READ, ("accept", bulb))
+		self.wakeup_recv, self.wakeup_send = socket.socketpair()
+		self.wakeup_recv.setblocking(0)
+		self.selector.register(self.wakeup_recv, selectors.EVENT_READ, ("wakeup", None))
+		self.running = True
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		"""Stops serving and closes every socket, clients see their connections drop"""
+		if self.thread is None:
+			return
+		self.running = False
+		self.wakeup_send.send(b"\0")
+		self.thread.join()
+		self.thread = None
+		for key in list(self.selector.get_map().values()):
+			key.fileobj.close()
+		self.selector.close()
+		self.wakeup_send.close()
+		for bulb in self.bulbs:
+			bulb.clients = []
+			bulb.music = None
+			bulb.state["music_on"] = 0
+		self.outbox = []
+		self.buffers = {}
+
+	def advertise(self, address, notify = True):
+		"""Sends every bulb's advertisement to 'address', e.g. a controller's listen socket"""
+		for bulb in self.bulbs:
+			self.send_later(bulb, self.search_socket, bulb.search_response(notify).encode(), address)
+
+	def send_later(self, bulb, sock, data, address = None):
+		"""Queues data to go out after the bulb's latency"""
+		with self._lock:
+			heapq.heappush(self.outbox, (time.monotonic() + bulb.latency, next(self.seq), sock, data, address))
+		if threading.current_thread() is not self.thread:
+			self.wakeup_send.send(b"\0")
+
+	def flush(self):
+		"""Sends everything that is due, returns the time until the next item or None"""
+		while True:
+			with self._lock:
+				if not self.outbox:
+					return None
+				due = self.outbox[0][0] - time.monotonic()
+				if due > 0:
+					return due
+				_, _, sock, data, address = heapq.heappop(self.outbox)
+			try:
+				if address is None:
+					sock.sendall(data)
+				else:
+					sock.sendto(data, address)
+			except OSError:
+				pass #Client went away
+
+	def run(self):
+		while self.running:
+			timeout = self.flush()
+			for key, _ in self.selector.select(timeout):
+				kind, bulb = key.data
+				if kind == "search":
+					self.handle_search()
+				elif kind == "accept":
+					self.handle_accept(bulb)
+				elif kind == "wakeup":
+					try:
+						self.wakeup_recv.recv(64)
+					except BlockingIOError:
+						pass
+				else:
+					self.handle_client(key.fileobj, bulb, kind == "music")
+
+	def handle_search(self):
+		try:
+			data, address = self.search_socket.recvfrom(2048)
+		except OSError:
+			return
+		if b"M-SEARCH" not in data or b"wifi_bulb" not in data:
+			return
+		for bulb in self.bulbs:
+			if self.random.random() < bulb.loss:
+				bulb.dropped += 1
+				continue
+			self.send_later(bulb, self.search_socket, bulb.search_response().encode(), address)
+
+	def handle_accept(self, bulb):
+		conn, _ = bulb.server.accept()
+		if len(bulb.clients) >= bulb.max_connections:
+			conn.close() #Connection limit of the firmware
+			return
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		bulb.clients.append(conn)
+		self.selector.register(conn, selectors.EVENT_READ, ("client", bulb))
+		self.buffers[conn] = b""
+
+	def drop_client(self, conn, bulb):
+		self.selector.unregister(conn)
+		conn.close()
+		self.buffers.pop(conn, None)
+		if conn in bulb.clients:
+			bulb.clients.remove(conn)
+		if conn is bulb.music:
+			bulb.music = None
+			bulb.state["music_on"] = 0
+
+	def handle_client(self, conn, bulb, music):
+		try:
+			data = conn.recv(4096)
+		except OSError:
+			data = b""
+		if not data:
+			self.drop_client(conn, bulb)
+			return
+		lines = (self.buffers.get(conn, b"") + data).split(FRAME_END)
+		self.buffers[conn] = lines.pop()
+		for line in lines:
+			if line.strip():
+				self.handle_request(conn, bulb, music, line)
+
+	def handle_request(self, conn, bulb, music, line):
+		if self.random.random() < bulb.loss:
+			bulb.dropped += 1
+			return
+		frame = parse_frame(line)
+		if frame is None:
+			if not music:
+				self.reply(bulb, conn, {"id": None, "error": {"code": -1, "message": ERROR_COMMAND}})
+			return
+		msg_id = frame.get("id")
+		method = frame.get("method")
+		params = frame.get("params", [])
+		if not music and not bulb.take_quota(time.monotonic()):
+			bulb.rejected += 1
+			self.reply(bulb, conn, {"id": msg_id, "error": {"code": -1, "message": ERROR_QUOTA}})
+			return
+		try:
+			result, changed = bulb.execute(method, params)
+		except ValueError as e:
+			if not music:
+				self.reply(bulb, conn, {"id": msg_id, "error": {"code": -1, "message": str(e)}})
+			return
+		if not music:
+			self.reply(bulb, conn, {"id": msg_id, "result": result})
+		if method == "set_music":
+			self.switch_music(bulb, params)
+		if changed and bulb.music is None:
+			notification = {"method": "props", "params": changed}
+			for client in bulb.clients:
+				self.reply(bulb, client, notification)
+
+	def reply(self, bulb, conn, frame):
+		self.send_later(bulb, conn, json.dumps(frame, separators = (",", ":")).encode() + FRAME_END)
+
+	def switch_music(self, bulb, params):
+		"""Connects back to the controller for set_music 1, closes the music connection for set_music 0"""
+		if bulb.music is not None:
+			self.drop_client(bulb.music, bulb)
+		if int(params[0]) != 1:
+			return
+		try:
+			conn = socket.create_connection((params[1], int(params[2])), 2)
+		except (OSError, ValueError):
+			return
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		bulb.music = conn
+		bulb.state["music_on"] = 1
+		self.buffers[conn] = b""
+		self.selector.register(conn, selectors.EVENT_READ, ("music", bulb))
+
+#----------Main----------
+def main(argv):
+	"""python YeeSimulator.py [count] [search_port] - serves until Ctrl+C"""
+	count = int(argv[1]) if len(argv) > 1 else 1
+	search_port = int(argv[2]) if len(argv) > 2 else 0
+	sim = Simulator(count, search_port = search_port)
+	sim.start()
+	print("Simulating " + str(count) + " bulbs, search address " + sim.host + ":" + str(sim.search_port))
+	for bulb in sim.bulbs:
+		print("  " + bulb.hw_id + " " + sim.host + ":" + str(bulb.port))
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	sim.stop()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
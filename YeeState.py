@@ -0,0 +1,67 @@
+from array import array
+from YeeProtocol import PROP_TYPES
+
+#----------Variables----------
+PROPS = tuple(PROP_TYPES) #Properties with a fixed slot, in layout order
+PROP_INDEX = {prop: index for index, prop in enumerate(PROPS)}
+NEVER = float("-inf") #Update time of a property that was never reported
+_unset_times = array("d", [NEVER] * len(PROPS))
+
+#State cache class
+class YeeState:
+	"""
+	Property cache of one bulb in a fixed layout.
+	The PROPS values live in one list and their update times (time.monotonic()) in one array of doubles,
+	so a bulb costs the same few hundred bytes however often it reports. Properties outside PROPS
+	(e.g. the background light of some models) go to 'extra', created on first use.
+	"""
+	__slots__ = ("values", "times", "extra")
+
+	def __init__(self):
+		self.values = [None] * len(PROPS)
+		self.times = array("d", _unset_times)
+		self.extra = None #{prop: (value, time)}
+
+	def get(self, prop, default = None):
+		"""Last known value of 'prop', 'default' if it was never reported"""
+		index = PROP_INDEX.get(prop)
+		if index is not None:
+			if self.times[index] == NEVER:
+				return default
+			return self.values[index]
+		if self.extra is not None and prop in self.extra:
+			return self.extra[prop][0]
+		return default
+
+	def set(self, prop, value, now):
+		index = PROP_INDEX.get(prop)
+		if index is not None:
+			self.values[index] = value
+			self.times[index] = now
+			return
+		if self.extra is None:
+			self.extra = {}
+		self.extra[prop] = (value, now)
+
+	def updated(self, prop):
+		"""time.monotonic() of the last update of 'prop', NEVER if it was never reported"""
+		index = PROP_INDEX.get(prop)
+		if index is not None:
+			return self.times[index]
+		if self.extra is not None and prop in self.extra:
+			return self.extra[prop][1]
+		return NEVER
+
+	def last_update(self):
+		"""time.monotonic() of the newest update, NEVER if nothing was reported"""
+		newest = max(self.times)
+		if self.extra:
+			newest = max(newest, max(entry[1] for entry in self.extra.values()))
+		return newest
+
+	def as_dict(self):
+		"""{prop: value} of every reported property"""
+		state = {prop: self.values[index] for index, prop in enumerate(PROPS) if self.times[index] != NEVER}
+		if self.extra:
+			state.update((prop, entry[0]) for prop, entry in self.extra.items())
+		return state